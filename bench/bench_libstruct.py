@@ -0,0 +1,202 @@
+"""
+Benchmarks for LibStruct against the struct module it wraps.
+
+Every case is timed with timeit and, where there is an equivalent, the same work done with a
+struct.Struct directly so the overhead of the wrapper is visible.  Results are written as JSON,
+and when a previous results file is given any case that got slower than the allowed threshold
+fails the run.
+
+    python bench/bench_libstruct.py --output bench.json
+    python bench/bench_libstruct.py --compare bench.json --threshold 0.15
+
+Only the standard library is needed, nothing is fetched from the network.
+"""
+
+import argparse
+import io
+import json
+import platform
+import struct
+import sys
+import timeit
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import libstruct  # noqa: E402
+
+DEFAULT_SIZES = (4, 64, 1024, 64 * 1024, 1024 * 1024)
+
+# Number of records used by the bulk cases.
+BULK_RECORDS = 10_000
+
+SHORT_FORMAT = "little_endian uint32 float 8*s"
+LONG_FORMAT = "big_endian " + " ".join(["bool ubyte byte uint16 int16 uint32 int32 uint64 int64 float double"] * 8)
+
+
+def time_per_call(func, min_time: float) -> float:
+    """Return the best seconds per call of func over a few autoranged repeats."""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    # autorange aims for 0.2s, scale the loop count to the requested minimum time.
+    number = max(1, int(number * min_time / 0.2))
+    return min(timer.repeat(repeat=3, number=number)) / number
+
+
+def record_case(results, name, size, func, baseline=None, min_time=0.2):
+    seconds = time_per_call(func, min_time)
+    baseline_seconds = time_per_call(baseline, min_time) if baseline else None
+    results.append({
+        "name": name,
+        "size": size,
+        "seconds": seconds,
+        "baseline_seconds": baseline_seconds,
+        "overhead": seconds / baseline_seconds if baseline_seconds else None,
+    })
+    overhead = f"{seconds / baseline_seconds:6.2f}x baseline" if baseline_seconds else ""
+    print(f"{name:<24} {size:>9} B {seconds * 1e6:14.3f} us {overhead}", flush=True)
+
+
+def bench_parsing(results, min_time):
+    for label, fmt in (("short", SHORT_FORMAT), ("long", LONG_FORMAT)):
+        size = struct.calcsize(libstruct.LibStruct.decode_human_readable_fmt(fmt))
+        # Compiling directly bypasses the format cache, so this is the real parsing cost.
+        record_case(results, f"parse_{label}", size, lambda: libstruct.CompiledFormat(fmt), min_time=min_time)
+        record_case(results, f"construct_{label}", size,
+                    lambda: libstruct.LibStruct(fmt), min_time=min_time)
+
+
+def bench_record_sizes(results, sizes, min_time):
+    for size in sizes:
+        count = max(size // 4, 1)
+        bs = libstruct.LibStruct(f"little_endian {count}*uint32")
+        raw = struct.Struct(bs.format)
+        values = [i & 0xFFFFFFFF for i in range(count)]
+        packed = bs.pack(*values)
+
+        record_case(results, "pack", bs.size, lambda: bs.pack(*values), lambda: raw.pack(*values), min_time)
+        record_case(results, "unpack", bs.size, lambda: bs.unpack(packed), lambda: raw.unpack(packed), min_time)
+
+        text = libstruct.LibStruct(f"{size}*s")
+        text.pack(bytes(range(256)) * (size // 256) + bytes(range(size % 256)))
+        record_case(results, "to_ascii", size, text.to_ascii, min_time=min_time)
+        record_case(results, "as_hex", size, lambda: text.as_hex(columns=16, show_ascii=True), min_time=min_time)
+        record_case(results, "iter_hex", size, lambda: "\n".join(text.iter_hex(columns=16, show_ascii=True)),
+                    min_time=min_time)
+
+
+def bench_bulk(results, min_time):
+    bs = libstruct.LibStruct(SHORT_FORMAT)
+    raw = struct.Struct(bs.format)
+    records = [(i, i * 0.5, b"tag") for i in range(BULK_RECORDS)]
+    data = b"".join(raw.pack(*record) for record in records)
+    size = len(data)
+
+    record_case(results, "bulk_pack_many", size, lambda: bs.pack_many(records),
+                lambda: b"".join([raw.pack(*record) for record in records]), min_time)
+    record_case(results, "bulk_iter_unpack", size, lambda: list(bs.iter_unpack(data)),
+                lambda: list(raw.iter_unpack(data)), min_time)
+    record_case(results, "bulk_unpack_loop", size,
+                lambda: [bs.unpack(data[i:i + bs.size]) for i in range(0, size, bs.size)],
+                lambda: [raw.unpack(data[i:i + raw.size]) for i in range(0, size, raw.size)], min_time)
+
+
+def bench_compressed(results, min_time):
+    """
+    Decode records from gzip, bz2 and xz compressed captures held in memory.
+
+    The baseline reads the same records uncompressed, so the overhead is the cost of
+    decompressing on the fly.
+    """
+    bs = libstruct.LibStruct(SHORT_FORMAT)
+    records = [(i, i * 0.5, b"tag") for i in range(BULK_RECORDS)]
+    data = bs.pack_many(records)
+
+    for compression in ("gzip", "bz2", "lzma"):
+        compressed = io.BytesIO()
+        with libstruct.open_capture(compressed, "wb", compression=compression, level=1) as file:
+            bs.pack_many(records, file=file)
+        packed = compressed.getvalue()
+        record_case(results, f"compressed_{compression}", len(data),
+                    lambda: list(bs.iter_unpack(io.BytesIO(packed), compression=compression)),
+                    lambda: list(bs.iter_unpack(io.BytesIO(data))), min_time)
+
+
+def bench_threads(results, min_time, thread_counts=(2, 4, 8)):
+    """
+    Unpack the same amount of data with one shared FrozenLibStruct from several threads.
+
+    The baseline is a single thread doing all the work, so an overhead below 1 means the work
+    scales with threads (free-threaded CPython), and about 1 means it is serialized by the GIL.
+    """
+    bs = libstruct.FrozenLibStruct(SHORT_FORMAT)
+    data = bs.pack_many([(i, i * 0.5, b"tag") for i in range(BULK_RECORDS)])
+    chunks = 8
+
+    def unpack_all():
+        for _ in range(chunks):
+            for _ in bs.iter_unpack(data):
+                pass
+
+    for threads in thread_counts:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            def unpack_threaded():
+                futures = [pool.submit(lambda: list(bs.iter_unpack(data))) for _ in range(chunks)]
+                for future in futures:
+                    future.result()
+
+            record_case(results, f"threads_unpack_{threads}", len(data) * chunks, unpack_threaded, unpack_all,
+                        min_time)
+
+
+def compare(results, baseline_path: Path, threshold: float) -> list[str]:
+    """Return a message for every case slower than the baseline by more than threshold."""
+    baseline = {(case["name"], case["size"]): case for case in json.loads(baseline_path.read_text())["results"]}
+    regressions = []
+    for case in results:
+        previous = baseline.get((case["name"], case["size"]))
+        if previous and case["seconds"] > previous["seconds"] * (1 + threshold):
+            change = case["seconds"] / previous["seconds"] - 1
+            regressions.append(f"{case['name']} ({case['size']} B) is {change:.0%} slower than the baseline")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--output", type=Path, help="write the results to this JSON file")
+    parser.add_argument("--compare", type=Path, help="results JSON file from an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="allowed slowdown against --compare before failing (default 0.10)")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                        help="record sizes in bytes (default: %(default)s)")
+    parser.add_argument("--min-time", type=float, default=0.2, help="minimum seconds spent timing each case")
+    args = parser.parse_args(argv)
+
+    results = []
+    bench_parsing(results, args.min_time)
+    bench_record_sizes(results, args.sizes, args.min_time)
+    bench_bulk(results, args.min_time)
+    bench_compressed(results, args.min_time)
+    bench_threads(results, args.min_time)
+
+    report = {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "results": results,
+    }
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        for message in regressions:
+            print(f"REGRESSION: {message}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
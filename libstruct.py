@@ -1,21 +1,1340 @@
+import array
+import argparse
+import bz2
+import csv
+import io
+import itertools
+import json
+import functools
+import gzip
+import keyword
+import linecache
+import lzma
+import mmap
+import operator
+import os
+import re
 import struct
+import sys
+import threading
+import time
+from collections import OrderedDict, deque, namedtuple
+from collections.abc import Mapping
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 
 import hexout
 
 
+class FormatError(ValueError):
+    """
+    A human readable format string could not be compiled.
+
+    Instance Variables:
+        message: What is wrong, without the location.
+        format_string: The format string being compiled.
+        position: Index in format_string of the offending part.
+    """
+
+    def __init__(self, message: str, format_string: str, position: int):
+        self.message = message
+        self.format_string = format_string
+        self.position = position
+        # args holds the constructor arguments so the error pickles, e.g. out of a worker process.
+        super().__init__(message, format_string, position)
+
+    def __str__(self):
+        return f"{self.message} at position {self.position}\n    {self.format_string}\n    {' ' * self.position}^"
+
+
+# One entry per part of a compiled format, padding included.  Offsets and sizes honour the
+# alignment rules of the byte order, so native formats get the same padding as struct.
+# bits holds the Bitfields of an integer declared as 'uint16{mode:3,err:1}', otherwise None.
+FieldLayout = namedtuple('FieldLayout', 'code count offset size name type alignment position bits')
+
+# A bit field within an integer value, shift counts from the least significant bit.
+Bitfield = namedtuple('Bitfield', 'name shift width mask')
+
+# One entry per unpacked value, the offset within the record and a struct.Struct that
+# decodes just that value.
+ValueLayout = namedtuple('ValueLayout', 'name offset struct')
+
+_STRUCT_FORMATS = {
+    "bool": "?",
+    "byte": "b",
+    "int8": "b",
+    "ubyte": "B",
+    "uint8": "B",
+    "int16": "h",
+    "uint16": "H",
+    "int32": "i",
+    "uint32": "I",
+    "int64": "q",
+    "uint64": "Q",
+    "float": "f",
+    "double": "d",
+    "char": "c",
+    "s": "s",
+    "string": "s",
+    "str": "s",
+    "p": "p",
+    "pascal": "p",
+    "P": "P",
+    "pointer": "P",
+    "padding": "x",
+    "pad": 'x',
+}
+
+_ENDIAN_FLAGS = {
+    "little_endian": "<",
+    "big_endian": ">",
+    "network": "!",
+    "native": "="
+}
+
+# (size, alignment) of one item of each struct code.  Explicit byte orders use standard
+# sizes without alignment, a pointer only exists in native mode.
+_STANDARD_SIZES = {'x': (1, 1), 'c': (1, 1), 'b': (1, 1), 'B': (1, 1), '?': (1, 1), 'h': (2, 1), 'H': (2, 1),
+                   'i': (4, 1), 'I': (4, 1), 'q': (8, 1), 'Q': (8, 1), 'f': (4, 1), 'd': (8, 1),
+                   's': (1, 1), 'p': (1, 1)}
+_NATIVE_SIZES = {code: (struct.calcsize(code), struct.calcsize('c0' + code)) for code in set(_STRUCT_FORMATS.values())}
+
+# A part is everything up to the next white space, except inside bitfield braces.
+_PART = re.compile(r'(?:[^\s{]|\{[^}]*\}?)+')
+
+
+def _valid_field_name(name: str) -> bool:
+    return name.isidentifier() and not name.startswith('_') and not keyword.iskeyword(name)
+
+
+def _value_count(code: str, count: int) -> int:
+    """Number of values a part unpacks to, struct gives one per string and none for padding."""
+    return 0 if code == 'x' else 1 if code in 'sp' else count
+
+
+def _compile_bits(format_string: str, text: str, position: int, code: str) -> tuple[Bitfield, ...]:
+    """Compile the 'name:width,...' inside bitfield braces, fields are allocated from bit 0 up."""
+    if code not in 'bBhHiIqQ':
+        raise FormatError("bitfields need an integer type", format_string, position - 1)
+    bits = _STANDARD_SIZES[code][0] * 8
+
+    fields = []
+    shift = 0
+    for match in re.finditer(r'[^,]+', text):
+        spec = match.group().strip()
+        at = position + match.start() + len(match.group()) - len(match.group().lstrip())
+        name, colon, width = spec.partition(':')
+        if not colon or not width.strip().isdigit() or int(width) < 1:
+            raise FormatError(f"bitfield '{spec}' must be 'name:width' with a width of at least 1",
+                              format_string, at)
+        if not _valid_field_name(name):
+            raise FormatError(f"invalid bitfield name '{name}'", format_string, at)
+        width = int(width)
+        if shift + width > bits:
+            raise FormatError(f"bitfields need more than the {bits} bits of the value", format_string, at)
+        fields.append(Bitfield(name, shift, width, (1 << width) - 1))
+        shift += width
+
+    if not fields:
+        raise FormatError("empty bitfield list", format_string, position)
+    return tuple(fields)
+
+
+def _nested_parts(sub: 'CompiledFormat', prefix: str, count: int, position: int) -> list:
+    """
+    Expand count copies of a registered format into parts of the format that references it.
+
+    Values are named <prefix>_<name> (<prefix>_<i>_<name> for repeats), bitfields likewise.
+    """
+    parts = []
+    for i in range(count):
+        item_prefix = f"{prefix}_{i}" if count > 1 else prefix
+        index = 0
+        for code, sub_count, name, type_, _, bits in sub._parts:
+            values = _value_count(code, sub_count)
+            if bits:
+                bits = tuple(bit._replace(name=f"{item_prefix}_{bit.name}") for bit in bits)
+            if name or values <= 1:
+                part_name = f"{item_prefix}_{name or sub.field_names[index]}" if values else None
+                parts.append((code, sub_count, part_name, type_, position, bits))
+            else:
+                # Unnamed repeats are split so every value keeps the name it has in the sub format.
+                parts.extend((code, 1, f"{item_prefix}_{sub.field_names[index + k]}", type_, position, None)
+                             for k in range(values))
+            index += values
+    return parts
+
+
+def _compile(format_string: str):
+    """
+    Tokenize and compile a human readable format string.
+
+    Returns:
+        tuple: The struct byte order character ('' for native with alignment), the parts as
+               (code, count, name, type, position, bits) tuples, the struct format with
+               adjacent parts of the same type merged into a single repeat, and the references
+               to registered formats as (name, CompiledFormat, count or None, first part,
+               number of parts) tuples.
+
+    Raises:
+        FormatError: For unknown types, malformed repeats, misplaced byte orders and bad
+                     field names.
+    """
+    byte_order = ''
+    parts = []
+    groups = []
+    for match in _PART.finditer(format_string):
+        text, position = match.group(), match.start()
+
+        if text in _ENDIAN_FLAGS:
+            if parts or byte_order:
+                raise FormatError(f"byte order '{text}' must be the first part", format_string, position)
+            byte_order = _ENDIAN_FLAGS[text]
+            continue
+
+        # Take out any bitfields first, their 'name:width' would look like a field name.
+        bits_text = None
+        if '{' in text:
+            start = text.index('{')
+            end = text.find('}', start)
+            if end < 0:
+                raise FormatError("missing '}' after bitfields", format_string, position + start)
+            bits_text, bits_position = text[start + 1:end], position + start + 1
+            if text[end + 1:] and text[end + 1] != ':':
+                raise FormatError("unexpected text after bitfields", format_string, position + end + 1)
+            text = text[:start] + text[end + 1:]
+            position_shift = end + 1 - start
+        else:
+            position_shift = 0
+
+        part, colon, name = text.partition(':')
+        if colon and not _valid_field_name(name):
+            raise FormatError(f"invalid field name '{name}'", format_string,
+                              position + position_shift + len(part) + 1)
+
+        repeat, star, type_ = part.rpartition('*')
+        if star and not repeat.isdigit():
+            raise FormatError(f"repeat count '{repeat}' is not a whole number", format_string, position)
+        if type_ in _NAMED_FORMATS:
+            if bits_text is not None:
+                raise FormatError("bitfields need an integer type", format_string, bits_position - 1)
+            sub = format_cache.get(_NAMED_FORMATS[type_])
+            if sub.byte_order != byte_order:
+                if sub.byte_order:
+                    raise FormatError(f"format '{type_}' has a different byte order", format_string, position)
+                # Inlined without alignment a native format would lose the padding it was laid out with.
+                raise FormatError(f"format '{type_}' has native alignment and no byte order",
+                                  format_string, position)
+            count = int(repeat) if star else 1
+            if count > 1 and sub.size % sub.alignment:
+                # Copies are inlined back to back, without the tail padding an array of them would have.
+                raise FormatError(f"format '{type_}' can't be repeated, its size isn't a multiple of its "
+                                  f"alignment", format_string, position)
+            expanded = _nested_parts(sub, name or type_, count, position)
+            groups.append((name or type_, sub, count if star else None, len(parts), len(expanded)))
+            parts.extend(expanded)
+            continue
+        if type_ not in _STRUCT_FORMATS:
+            raise FormatError(f"unknown type '{type_}'", format_string, position + len(repeat) + len(star))
+        code = _STRUCT_FORMATS[type_]
+
+        bits = None
+        if bits_text is not None:
+            if star:
+                raise FormatError("bitfields can't be repeated", format_string, position)
+            bits = _compile_bits(format_string, bits_text, bits_position, code)
+
+        parts.append((code, int(repeat) if star else 1, name or None, type_, position, bits))
+
+    # Merge runs of the same type, '3i 2i' and '3i2i' unpack identically.  Strings can't be
+    # merged, their repeat is a length.
+    tokens = []
+    for code, count, *_ in parts:
+        if tokens and code not in 'sp' and tokens[-1][0] == code and count and tokens[-1][1]:
+            tokens[-1][1] += count
+        else:
+            tokens.append([code, count])
+    struct_format = byte_order + ''.join(code if count == 1 else f"{count}{code}" for code, count in tokens)
+
+    return byte_order, tuple(parts), struct_format, tuple(groups)
+
+
+def _field_layout(byte_order: str, parts) -> tuple[FieldLayout, ...]:
+    """Work out the offset, size and alignment of every part."""
+    sizes = _NATIVE_SIZES if byte_order == '' else _STANDARD_SIZES
+    fields = []
+    offset = 0
+    for code, count, name, type_, position, bits in parts:
+        item_size, alignment = sizes[code]
+        offset = -(-offset // alignment) * alignment
+        size = count if code in 'sp' else count * item_size
+        fields.append(FieldLayout(code, count, offset, size, name, type_, alignment, position, bits))
+        offset += size
+    return tuple(fields)
+
+
+def _field_names(format_string: str, parts) -> tuple[str, ...]:
+    """
+    Name every unpacked value.
+
+    A named repeat such as '3*int32:xyz' names its values xyz_0, xyz_1 and xyz_2, and unnamed
+    values are called field_<index>.
+    """
+    names = []
+    seen = set()
+    for code, count, name, _, position, _ in parts:
+        values = _value_count(code, count)
+        for i in range(values):
+            if not name:
+                value_name = f"field_{len(names)}"
+            elif values == 1:
+                value_name = name
+            else:
+                value_name = f"{name}_{i}"
+            if value_name in seen:
+                raise FormatError(f"duplicate field name '{value_name}'", format_string, position)
+            seen.add(value_name)
+            names.append(value_name)
+    return tuple(names)
+
+
+def _bitfield_table(format_string: str, parts) -> tuple[tuple[int, Bitfield], ...]:
+    """Return (value index, Bitfield) for every bitfield, in format order."""
+    table = []
+    seen = set()
+    index = 0
+    for code, count, _, _, position, bits in parts:
+        for bit in bits or ():
+            if bit.name in seen:
+                raise FormatError(f"duplicate bitfield name '{bit.name}'", format_string, position)
+            seen.add(bit.name)
+            table.append((index, bit))
+        index += _value_count(code, count)
+    return tuple(table)
+
+
+def _extract_bits(words: array.array, bit: Bitfield) -> array.array:
+    """Extract one bitfield from a whole column of integers, vectorized with NumPy when it is installed."""
+    typecode = words.typecode.upper()
+    np = _numpy()
+    if np is not None:
+        extracted = (np.frombuffer(words, dtype=words.typecode) >> bit.shift) & bit.mask
+        column = array.array(typecode)
+        column.frombytes(extracted.astype(typecode).tobytes())
+        return column
+    shift, mask = bit.shift, bit.mask
+    return array.array(typecode, [(word >> shift) & mask for word in words])
+
+
+def _value_layout(byte_order: str, fields: tuple[FieldLayout, ...],
+                  names: tuple[str, ...]) -> tuple[ValueLayout, ...]:
+    """Expand field layouts into one ValueLayout per unpacked value."""
+    structs = {}
+
+    def single(token):
+        if token not in structs:
+            structs[token] = struct.Struct(byte_order + token)
+        return structs[token]
+
+    values = []
+    for field in fields:
+        if field.code == 'x':
+            continue
+        if field.code in 'sp':
+            values.append((field.offset, single(f"{field.count}{field.code}")))
+            continue
+        item_size = field.size // field.count if field.count else 0
+        for i in range(field.count):
+            values.append((field.offset + i * item_size, single(field.code)))
+    return tuple(ValueLayout(name, offset, struct_) for name, (offset, struct_) in zip(names, values))
+
+
+# struct byte order characters that match the memory order of this machine.
+_NATIVE_BYTE_ORDERS = '@=<' if sys.byteorder == 'little' else '@=>!'
+
+
+def _gather_column(view: memoryview, offset: int, width: int, record_size: int) -> bytearray:
+    """
+    Copy one field of every record in view into a contiguous buffer.
+
+    The copy is done one byte lane at a time with strided slices, so the work per field is a
+    handful of C level copies however many records there are.
+    """
+    count = len(view) // record_size
+    if width == record_size:
+        return bytearray(view)
+    column = bytearray(count * width)
+    end = count * record_size
+    for lane in range(width):
+        column[lane::width] = view[offset + lane:end:record_size]
+    return column
+
+
+@functools.cache
+def _array_typecode(code: str, width: int) -> str:
+    """Return the array module type code holding a struct value of the given code and size."""
+    if code in 'fd':
+        return code
+    candidates = 'bhilq' if code in 'bhilqn' else 'BHILQ'
+    for typecode in candidates:
+        if array.array(typecode).itemsize == width:
+            return typecode
+    raise ValueError(f"no array type code holds a {width} byte '{code}' value")
+
+
+def _column(view: memoryview, value: ValueLayout, record_size: int, byte_order: str):
+    """Decode one value of every record into an array.array, or a list of bytes for strings."""
+    code = value.struct.format[-1]
+    width = value.struct.size
+    data = _gather_column(view, value.offset, width, record_size)
+
+    if code in 'sc':
+        return [bytes(data[start:start + width]) for start in range(0, len(data), width)]
+    if code == 'p':
+        return [value.struct.unpack_from(data, start)[0] for start in range(0, len(data), width)]
+
+    column = array.array(_array_typecode(code, width))
+    column.frombytes(data)
+    if width > 1 and byte_order not in _NATIVE_BYTE_ORDERS:
+        column.byteswap()
+    return column
+
+
+def _swap_lanes(view: memoryview, offset: int, width: int, record_size: int):
+    """Reverse the bytes of one value of every record in view, in place, a pair of byte lanes at a time."""
+    for lane in range(width // 2):
+        low = offset + lane
+        high = offset + width - 1 - lane
+        saved = bytes(view[low::record_size])
+        view[low::record_size] = view[high::record_size]
+        view[high::record_size] = saved
+
+
+def _is_little_endian(byte_order: str) -> bool:
+    """True when a struct byte order character stores integers least significant byte first."""
+    return byte_order == '<' or (byte_order == '=' and sys.byteorder == 'little')
+
+
+@functools.cache
+def _numpy():
+    """Import NumPy on first use, it is slow to import and only the array helpers need it."""
+    try:
+        import numpy
+    except ImportError:  # NumPy is an optional extra.
+        return None
+    return numpy
+
+
+def _require_numpy():
+    np = _numpy()
+    if np is None:
+        raise ImportError("NumPy is required for this feature, install it with 'pip install libstruct[numpy]'")
+    return np
+
+
+_NUMPY_BYTE_ORDER = {'@': '=', '=': '=', '<': '<', '>': '>', '!': '>'}
+_NUMPY_KIND = {'?': 'b', 'b': 'i', 'B': 'u', 'h': 'i', 'H': 'u', 'i': 'i', 'I': 'u', 'l': 'i', 'L': 'u',
+               'q': 'i', 'Q': 'u', 'n': 'i', 'N': 'u', 'P': 'u', 'e': 'f', 'f': 'f', 'd': 'f'}
+
+
+def _numpy_dtype(byte_order: str, fields: tuple[FieldLayout, ...], itemsize: int, field_names: tuple[str, ...]):
+    """
+    Build a NumPy structured dtype matching a compiled format.
+
+    Fields keep their names from the format, unnamed fields are named field_<index> after
+    their first value like field_names.  Repeated numeric types become a sub-array field and
+    padding is left as gaps between field offsets.
+    """
+    np_ = _require_numpy()
+    byte_order = _NUMPY_BYTE_ORDER.get(byte_order, '=')
+
+    names, formats, offsets = [], [], []
+    value_index = 0
+    for field in fields:
+        first_value = value_index
+        value_index += _value_count(field.code, field.count)
+        if field.code == 'x':
+            continue
+        if field.code in 'sc':
+            format_ = f"S{field.size}"
+        elif field.code in _NUMPY_KIND:
+            item_size = field.size // field.count
+            format_ = f"{byte_order}{_NUMPY_KIND[field.code]}{item_size}"
+            if field.count != 1:
+                format_ = (format_, (field.count,))
+        else:
+            raise ValueError(f"struct type '{field.code}' has no NumPy equivalent")
+        names.append(field.name or field_names[first_value])
+        formats.append(format_)
+        offsets.append(field.offset)
+
+    return np_.dtype({'names': names, 'formats': formats, 'offsets': offsets, 'itemsize': itemsize})
+
+
+# Guards lazily built CompiledFormat attributes whose identity matters.
+_LAZY_INIT_LOCK = threading.Lock()
+
+
+class CompiledFormat:
+    """
+    The compiled form of a human readable format.
+
+    Compiling validates every part of the format and builds an intermediate representation:
+    the byte order, a FieldLayout (type, repeat, offset, size, alignment and position in the
+    format string) for every part, the name of every unpacked value, and a struct format in
+    which adjacent parts of the same type are merged into a single repeat.
+
+    Instances are shared between every LibStruct built from the same human readable
+    format string, so nothing in here may depend on the data being packed or unpacked.
+
+    Raises:
+        FormatError: If the format string is not valid.
+    """
+
+    __slots__ = ('human_format', 'byte_order', 'format', 'field_names', 'bitfields', 'groups', '_parts', '_struct',
+                 '_error', '_fields', '_dtype', '_record', '_bits_record', '_values', '_value_index', '_nesting',
+                 '_nested_record')
+
+    def __init__(self, human_format: str):
+        self.human_format = human_format
+        self.byte_order, self._parts, self.format, self.groups = _compile(human_format)
+        self.field_names = _field_names(human_format, self._parts)
+        self.bitfields = _bitfield_table(human_format, self._parts)
+
+        # Some formats are only rejected by struct (e.g. a pointer with an explicit byte
+        # order).  Remember the error and raise it when the format is used, not built.
+        try:
+            self._struct = struct.Struct(self.format)
+            self._error = None
+            self._fields = _field_layout(self.byte_order, self._parts)
+        except struct.error as exc:
+            self._struct = None
+            self._error = exc
+            self._fields = None
+
+        # Derived data is computed on first use, formats that never need it pay nothing.
+        self._dtype = None
+        self._record = None
+        self._bits_record = None
+        self._values = None
+        self._value_index = None
+        self._nesting = None
+        self._nested_record = None
+
+    @property
+    def struct(self) -> struct.Struct:
+        if self._struct is None:
+            raise struct.error(*self._error.args)
+        return self._struct
+
+    @property
+    def fields(self) -> tuple[FieldLayout, ...]:
+        """Layout of every part of the format, padding included, in format order."""
+        if self._fields is None:
+            raise struct.error(*self._error.args)
+        return self._fields
+
+    @property
+    def size(self) -> int:
+        """Size in bytes of one record, the same as struct.calcsize."""
+        return self.struct.size
+
+    @property
+    def alignment(self) -> int:
+        """Largest alignment of any field, always 1 with an explicit byte order."""
+        return max((field.alignment for field in self.fields), default=1)
+
+    @property
+    def dtype(self):
+        """The equivalent NumPy structured dtype."""
+        if self._dtype is None:
+            self._dtype = _numpy_dtype(self.byte_order, self.fields, self.size, self.field_names)
+        return self._dtype
+
+    @property
+    def record(self) -> type:
+        """Record class (a namedtuple, so a tuple subclass with empty __slots__) for this format."""
+        if self._record is None:
+            # Records are checked with isinstance/type, so threads must never see two classes.
+            with _LAZY_INIT_LOCK:
+                if self._record is None:
+                    self._record = namedtuple('Record', self.field_names)
+        return self._record
+
+    @property
+    def bits_record(self) -> type:
+        """Record class (a namedtuple) with one field per bitfield."""
+        if self._bits_record is None:
+            with _LAZY_INIT_LOCK:
+                if self._bits_record is None:
+                    self._bits_record = namedtuple('Bits', [bit.name for _, bit in self.bitfields])
+        return self._bits_record
+
+    @property
+    def nesting(self) -> tuple:
+        """
+        How nest() regroups the flat values: one (name, start, stop, CompiledFormat or None,
+        count or None) entry per top level field, plain values have no CompiledFormat.
+        """
+        if self._nesting is None:
+            starts = [0]
+            for code, count, *_ in self._parts:
+                starts.append(starts[-1] + _value_count(code, count))
+            groups = {first: (name, sub, count, part_count) for name, sub, count, first, part_count in self.groups}
+
+            nesting = []
+            part = 0
+            while part < len(self._parts):
+                if part in groups:
+                    name, sub, count, part_count = groups[part]
+                    nesting.append((name, starts[part], starts[part + part_count], sub, count))
+                    part += part_count
+                    continue
+                nesting.extend((self.field_names[index], index, index + 1, None, None)
+                               for index in range(starts[part], starts[part + 1]))
+                part += 1
+            self._nesting = tuple(nesting)
+        return self._nesting
+
+    @property
+    def nested_record(self) -> type:
+        """Record class returned by nest(), the plain record class when nothing is nested."""
+        if self._nested_record is None:
+            with _LAZY_INIT_LOCK:
+                if self._nested_record is None:
+                    self._nested_record = (namedtuple('Record', [entry[0] for entry in self.nesting])
+                                           if self.groups else self.record)
+        return self._nested_record
+
+    def uses_format(self, human_format: str) -> bool:
+        """True when this format includes the registered format human_format, directly or nested."""
+        return any(sub.human_format == human_format or sub.uses_format(human_format)
+                   for _, sub, *_ in self.groups)
+
+    def nest(self, values) -> tuple:
+        """Regroup the flat values of one record into the shape of the format, see LibStruct.nest."""
+        if not self.groups:
+            return self.record._make(values)
+        items = []
+        for _, start, stop, sub, count in self.nesting:
+            if sub is None:
+                items.append(values[start])
+            elif count is None:
+                items.append(sub.nest(values[start:stop]))
+            else:
+                width = (stop - start) // count if count else 0
+                items.append(tuple(sub.nest(values[item:item + width]) for item in range(start, stop, width or 1)))
+        return self.nested_record._make(items)
+
+    @property
+    def values(self) -> tuple[ValueLayout, ...]:
+        """Offset table with one entry per unpacked value, padding and repeats included."""
+        if self._values is None:
+            self._values = _value_layout(self.byte_order, self.fields, self.field_names)
+        return self._values
+
+    def value_index(self, name_or_index) -> int:
+        """Map a field name or value index to a value index."""
+        if isinstance(name_or_index, int):
+            if not -len(self.field_names) <= name_or_index < len(self.field_names):
+                raise IndexError(f"field index {name_or_index} out of range")
+            return name_or_index % len(self.field_names)
+        if self._value_index is None:
+            self._value_index = {name: index for index, name in enumerate(self.field_names)}
+        try:
+            return self._value_index[name_or_index]
+        except KeyError:
+            raise KeyError(f"no field named '{name_or_index}'") from None
+
+    def __repr__(self):
+        return f"CompiledFormat(human_readable_format: '{self.human_format}' struct_format: '{self.format}')"
+
+
+class FormatCache:
+    """
+    Process wide, size bounded LRU cache mapping human readable format strings to
+    CompiledFormat objects.
+
+    Creating a LibStruct is then a dictionary lookup rather than a re-parse of the format
+    string, and all instances for a format share a single struct.Struct.
+
+    Instance Variables:
+        maxsize: Maximum number of formats held before the least recently used is evicted.
+        hits: Number of lookups satisfied from the cache.
+        misses: Number of lookups that required compiling the format.
+        evictions: Number of formats dropped to stay within maxsize.
+    """
+
+    def __init__(self, maxsize: int = 256):
+        if maxsize < 1:
+            raise ValueError("maxsize must be >= 1")
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict[str, CompiledFormat] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, human_format: str):
+        return human_format in self._entries
+
+    def __repr__(self):
+        return (f"FormatCache(maxsize={self.maxsize}, size={len(self)}, hits={self.hits}, "
+                f"misses={self.misses}, evictions={self.evictions})")
+
+    def get(self, human_format: str) -> CompiledFormat:
+        """Return the compiled format for human_format, compiling and caching it on a miss."""
+        with self._lock:
+            compiled = self._entries.get(human_format)
+            if compiled is not None:
+                self.hits += 1
+                self._entries.move_to_end(human_format)
+                return compiled
+
+        # Compile outside the lock and before touching the cache so a bad format string
+        # never gets stored.
+        compiled = CompiledFormat(human_format)
+        with self._lock:
+            self.misses += 1
+            self._entries[human_format] = compiled
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return compiled
+
+    def evict(self, predicate) -> int:
+        """Drop every cached format for which predicate(compiled) is true, return how many."""
+        with self._lock:
+            stale = [key for key, compiled in self._entries.items() if predicate(compiled)]
+            for key in stale:
+                del self._entries[key]
+            self.evictions += len(stale)
+        return len(stale)
+
+    def clear(self):
+        """Drop every cached format and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+
+format_cache = FormatCache()
+
+
+def compile_format(format_string: str) -> CompiledFormat:
+    """Compile a human readable format, or return the cached compilation."""
+    return format_cache.get(format_string)
+
+
+# Formats registered by name, so other formats can use them like a type.
+_NAMED_FORMATS = {}
+
+
+def register_format(name: str, fmt) -> CompiledFormat:
+    """
+    Register a format under a name that other formats can then use like a type.
+
+    'header 16*sample:samples' compiles to one flat struct holding the fields of header and
+    of 16 samples, unpacked with a single call.  The values are named header_<field> and
+    samples_<i>_<field>, and LibStruct.nest regroups them into sub-records on request.
+
+    Args:
+        name: A valid identifier that isn't a type or byte order name.
+        fmt: LibStruct or human readable format.  Its byte order, if any, must match the
+             formats that use it.  Native alignment is applied to the flattened fields, the
+             trailing padding a C compiler adds to an array of structs is not.
+
+    Raises:
+        ValueError: For a bad name, or a name already registered with another format.
+        FormatError: If the format is not valid.
+    """
+    human_format = fmt.human_format if isinstance(fmt, LibStruct) else fmt
+    if not _valid_field_name(name) or name in _STRUCT_FORMATS or name in _ENDIAN_FLAGS:
+        raise ValueError(f"'{name}' can't be used as a format name")
+    if _NAMED_FORMATS.get(name, human_format) != human_format:
+        raise ValueError(f"format name '{name}' is already registered as '{_NAMED_FORMATS[name]}'")
+    compiled = format_cache.get(human_format)
+    _NAMED_FORMATS[name] = human_format
+    return compiled
+
+
+def unregister_format(name: str):
+    """
+    Remove a format registered with register_format, so the name can be registered again.
+
+    Cached formats using the name are dropped from format_cache, so they are compiled again
+    against whatever the name means next.  LibStruct instances that already exist keep the
+    layout they were built with.
+
+    Raises:
+        KeyError: If no format is registered under name.
+    """
+    try:
+        human_format = _NAMED_FORMATS.pop(name)
+    except KeyError:
+        raise KeyError(f"no format registered as '{name}'") from None
+    format_cache.evict(lambda compiled: compiled.uses_format(human_format))
+
+
+def registered_formats() -> dict:
+    """Return a copy of the registered names and their human readable formats."""
+    return dict(_NAMED_FORMATS)
+
+
+# Files are read in blocks of about this many bytes, rounded down to a whole number of records.
+DEFAULT_BLOCK_SIZE = 1 << 20
+
+
+# Header of each supported compressed file format, checked beyond the magic number itself
+# (gzip compression method, bz2 block size and block or end of stream magic) so plain
+# captures are rarely mistaken for compressed ones.
+_COMPRESSION_MAGIC = ((re.compile(rb'\x1f\x8b\x08'), 'gzip'),
+                      (re.compile(rb'BZh[1-9](?:1AY&SY|\x17rE8P\x90)'), 'bz2'),
+                      (re.compile(rb'\xfd7zXZ\x00'), 'lzma'))
+_COMPRESSION_SUFFIXES = {'.gz': 'gzip', '.bz2': 'bz2', '.xz': 'lzma', '.lzma': 'lzma'}
+_COMPRESSION_OPENERS = {'gzip': gzip.open, 'bz2': bz2.open, 'lzma': lzma.open}
+_DECOMPRESSING_FILES = (gzip.GzipFile, bz2.BZ2File, lzma.LZMAFile)
+
+
+def _compression_of(file) -> str | None:
+    """
+    Detect the compression of a binary file object from its first bytes, without consuming them.
+
+    Files already decompressing are never detected again.  Files that can neither peek nor
+    seek are assumed to be uncompressed.
+    """
+    if isinstance(file, _DECOMPRESSING_FILES):
+        return None
+    if hasattr(file, 'peek'):
+        head = file.peek(10)[:10]
+    elif getattr(file, 'seekable', lambda: False)():
+        position = file.tell()
+        head = file.read(10)
+        file.seek(position)
+    else:
+        return None
+    for magic, compression in _COMPRESSION_MAGIC:
+        if magic.match(head):
+            return compression
+    return None
+
+
+def open_capture(file, mode: str = 'rb', compression: str = None, level: int = None):
+    """
+    Open a capture file for reading or writing records, compressed or not.
+
+    By default the compression of a path is taken from its suffix (.gz, .bz2, .xz or
+    .lzma) and file objects are used as they are.  'auto' recognizes gzip, bz2 and xz data
+    from its header when reading.  The result is a binary file object that
+    LibStruct.iter_unpack, scan and pack_many(file=...) read or write a block at a time, so
+    compressed data never needs to be expanded on disk.
+
+    Args:
+        file: A path or a binary file object.  A file object is not closed with the result.
+        mode: 'rb', 'wb' or 'ab'.
+        compression: 'gzip', 'bz2', 'lzma', 'auto' to detect it when reading, or None to go
+                     by the suffix of a path.
+        level: Compression level (the preset for lzma), None uses the module default.
+
+    Raises:
+        ValueError: For an unknown mode or compression.
+    """
+    if mode not in ('rb', 'wb', 'ab'):
+        raise ValueError(f"mode must be 'rb', 'wb' or 'ab', not {mode!r}")
+    if compression not in (None, 'auto', *_COMPRESSION_OPENERS):
+        raise ValueError(f"unknown compression '{compression}', expected 'auto' or one of "
+                         f"{', '.join(_COMPRESSION_OPENERS)}")
+
+    is_path = isinstance(file, (str, os.PathLike))
+    if compression == 'auto' and mode == 'rb':
+        if is_path:
+            with open(file, 'rb') as raw:
+                compression = _compression_of(raw)
+        else:
+            compression = _compression_of(file)
+    elif compression in (None, 'auto'):
+        compression = _COMPRESSION_SUFFIXES.get(os.path.splitext(file)[1]) if is_path else None
+
+    if compression is None:
+        return open(file, mode) if is_path else file
+    if mode == 'rb' or level is None:
+        return _COMPRESSION_OPENERS[compression](file, mode)
+    if compression == 'lzma':
+        return lzma.open(file, mode, preset=level)
+    return _COMPRESSION_OPENERS[compression](file, mode, compresslevel=level)
+
+
+def _iter_record_blocks(source, record_size: int, block_size: int = DEFAULT_BLOCK_SIZE, compression: str = None):
+    """
+    Yield buffers holding a whole number of records from a buffer, a binary file or a path.
+
+    Buffers (bytes, bytearray, memoryview, mmap...) are yielded as is, struct reads them
+    in place.  Files are read with readinto() into one reused block, so a yielded block
+    is only valid until the next one is requested.  Compressed paths, files and buffers
+    are decompressed a block at a time, see open_capture for compression.
+
+    Raises:
+        struct.error: If the data ends part way through a record.
+    """
+    if compression is not None and not isinstance(source, (str, os.PathLike)) and not hasattr(source, 'readinto'):
+        # Buffers are decompressed through a file object, 'auto' leaves plain buffers as they are.
+        buffered = io.BytesIO(source)
+        if compression != 'auto' or _compression_of(buffered):
+            source = buffered
+    if isinstance(source, (str, os.PathLike)) or (compression is not None and hasattr(source, 'readinto')):
+        capture = open_capture(source, compression=compression)
+        if capture is not source:
+            with capture:
+                yield from _iter_record_blocks(capture, record_size, block_size)
+            return
+    if not hasattr(source, 'readinto'):
+        yield source
+        return
+
+    if record_size < 1:
+        raise struct.error("record size must be >= 1 to read records from a file")
+
+    block = bytearray(max(block_size // record_size, 1) * record_size)
+    with memoryview(block) as view:
+        while True:
+            # Keep reading until the block is full, short reads (pipes, sockets) would
+            # otherwise leave a partial record at the end of the block.
+            filled = 0
+            while filled < len(block):
+                count = source.readinto(view[filled:])
+                if not count:
+                    break
+                filled += count
+
+            whole = filled - filled % record_size
+            if whole:
+                with view[:whole] as records:
+                    yield records
+
+            if filled < len(block):
+                if filled != whole:
+                    raise struct.error(f"{filled - whole} trailing bytes do not make up "
+                                       f"a whole {record_size} byte record")
+                return
+
+
+def _unpack_file_range(path: str, struct_format: str, start: int, stop: int, reduce=None):
+    """
+    Worker side of LibStruct.parallel_unpack.
+
+    The worker maps the file itself, so only the path and the byte range cross the process
+    boundary on the way in.  Only the decoded records (or the reduced result) come back.
+    Workers get the flattened struct format, formats registered by name in the parent are
+    unknown to spawned workers.
+    """
+    struct_ = struct.Struct(struct_format)
+    with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        with memoryview(mm) as whole, whole[start:stop] as view:
+            if reduce is None:
+                return list(struct_.iter_unpack(view))
+            return reduce(struct_.iter_unpack(view))
+
+
+@functools.cache
+def _ascii_table(unprintable_char: str) -> bytes:
+    """bytes.translate table mapping printable ASCII to itself and everything else to unprintable_char."""
+    pad = ord(unprintable_char.encode('latin-1'))
+    return bytes(byte_ if 32 <= byte_ < 127 else pad for byte_ in range(256))
+
+
+@functools.cache
+def _ascii_str_table(unprintable_char: str) -> dict:
+    """str.translate table for replacements that are not a single latin-1 character."""
+    return {byte_: unprintable_char for byte_ in range(256) if not 32 <= byte_ < 127}
+
+
+def _hex_line_formatter(bytes_per_column: int, addr_format: str, hex_format: str,
+                        show_ascii: bool, show_address: bool, ascii_pad: str):
+    """
+    Return a function formatting one line of a hex dump the same way hexout.HexOut does.
+
+    Whole columns printed with a plain zero padded hex format use bytes.hex(), everything
+    else falls back to formatting each column as an integer.
+    """
+    upper = hex_format == f"{{:0{2 * bytes_per_column}X}}"
+    fast = upper or hex_format == f"{{:0{2 * bytes_per_column}x}}"
+    table = _ascii_table(ascii_pad) if show_ascii and bytes_per_column == 1 else None
+
+    def format_line(address: int, line: memoryview) -> str:
+        if fast and len(line) % bytes_per_column == 0:
+            text = line.hex(' ', -bytes_per_column)
+            if upper:
+                text = text.upper()
+        else:
+            text = ' '.join(hex_format.format(int.from_bytes(line[start:start + bytes_per_column], 'big'))
+                            for start in range(0, len(line), bytes_per_column))
+        if show_address:
+            text = addr_format.format(address) + text
+        if table is not None:
+            text += ' ' + line.tobytes().translate(table).decode('latin-1')
+        return text
+
+    return format_line
+
+
+def _iter_window(source, offset: int, length: int, block_size: int):
+    """Yield memoryviews covering length bytes (None for all) of a buffer or file starting at offset."""
+    try:
+        view = memoryview(source)
+    except TypeError:
+        pass
+    else:
+        with view, view.cast('B') as data:
+            stop = len(data) if length is None else min(offset + length, len(data))
+            yield data[offset:stop]
+        return
+
+    if source.seekable():
+        source.seek(offset, os.SEEK_CUR)
+    else:
+        while offset:
+            skipped = len(source.read(min(offset, block_size)))
+            if not skipped:
+                return
+            offset -= skipped
+    while length is None or length > 0:
+        block = source.read(block_size if length is None else min(block_size, length))
+        if not block:
+            return
+        if length is not None:
+            length -= len(block)
+        yield memoryview(block)
+
+
+def iter_hex(source, offset: int = 0, length: int = None, columns: int = 16, bytes_per_column: int = 1,
+             base_address: int = 0, addr_format: str = "{:02X} ", hex_format: str = "{:02X}",
+             show_ascii: bool = False, show_address: bool = True, ascii_pad: str = '.',
+             block_size: int = DEFAULT_BLOCK_SIZE):
+    """
+    Lazily yield the lines of a hex dump of a buffer or a binary file.
+
+    Lines are laid out exactly like LibStruct.as_hex (and so hexout.HexOut) with the same
+    arguments, but files are read in blocks and only one line is formatted at a time, so
+    dumps of huge captures never build one huge string.
+
+    Args:
+        source: bytes, bytearray, memoryview, mmap or a binary file object.  Files are read
+                from their current position.
+        offset: Number of bytes to skip before the dump starts.
+        length: Number of bytes to dump, None dumps to the end.
+        columns: Columns per line, must be at least 1.
+        base_address: Address of the first byte of source.  Addresses include offset, so
+                      they always show where the line is in source.
+        ascii_pad: Character shown for unprintable bytes in the ASCII gutter.
+
+        See LibStruct.as_hex for the remaining arguments.
+
+    Yields:
+        str: One line of the dump, without a line separator.
+    """
+    if columns < 1:
+        raise ValueError("columns must be >= 1")
+    if bytes_per_column < 1:
+        raise ValueError("bytes_per_column must be >= 1")
+    if offset < 0:
+        raise ValueError("offset must be >= 0")
+
+    format_line = _hex_line_formatter(bytes_per_column, addr_format, hex_format, show_ascii, show_address, ascii_pad)
+    line_size = columns * bytes_per_column
+    address = base_address + offset
+    for block in _iter_window(source, offset, length, max(block_size // line_size, 1) * line_size):
+        for start in range(0, len(block), line_size):
+            yield format_line(address, block[start:start + line_size])
+            address += line_size
+
+
+def write_hex(file, source, line_separator: str = '\n', lines_per_write: int = 4096, **kwargs) -> int:
+    """
+    Write a hex dump of source to a text file in large blocks.
+
+    The text written is identical to line_separator.join(iter_hex(source, **kwargs)), with
+    lines_per_write lines joined for each write call.
+
+    Returns:
+        int: The number of lines written.
+    """
+    lines = iter_hex(source, **kwargs)
+    count = 0
+    while batch := [line for _, line in zip(range(lines_per_write), lines)]:
+        if count:
+            file.write(line_separator)
+        file.write(line_separator.join(batch))
+        count += len(batch)
+    return count
+
+
+def _converter_exprs(compiled: CompiledFormat, index: int, converter, namespace: dict) -> tuple[str, str]:
+    """
+    Return the unpack and pack expressions applying one converter to value v<index>.
+
+    Converters:
+        'strip':           Strip trailing NUL bytes from a string (packing pads them back).
+        'str':             Strip NULs and decode a string as UTF-8, ('str', encoding) picks
+                           another encoding.
+        'int':             A char as its integer value.
+        number:            Scale factor, unpacked values are multiplied by it and packed
+                           values divided by it (and rounded for integer fields).
+        callable:          Applied when unpacking, such a field can't be packed.
+        (decode, encode):  Callables applied when unpacking and packing.
+    """
+    value = f"v{index}"
+    code = compiled.values[index].struct.format[-1]
+    name = compiled.field_names[index]
+
+    if converter == 'strip' and code in 'sp':
+        return f"{value}.rstrip(b'\\x00')", value
+    if (converter == 'str' or isinstance(converter, tuple) and converter[:1] == ('str',)) and code in 'sp':
+        encoding = converter[1] if isinstance(converter, tuple) else 'utf-8'
+        return f"{value}.rstrip(b'\\x00').decode({encoding!r})", f"{value}.encode({encoding!r})"
+    if converter == 'int' and code == 'c':
+        return f"{value}[0]", f"_bytes(({value},))"
+    if isinstance(converter, (int, float)) and not isinstance(converter, bool) and code not in 'spc?':
+        namespace[f"_scale{index}"] = converter
+        pack = f"{value} / _scale{index}"
+        return f"{value} * _scale{index}", pack if code in 'fd' else f"round({pack})"
+    if callable(converter):
+        namespace[f"_decode{index}"] = converter
+        return f"_decode{index}({value})", None
+    if isinstance(converter, tuple) and len(converter) == 2 and all(map(callable, converter)):
+        namespace[f"_decode{index}"], namespace[f"_encode{index}"] = converter
+        return f"_decode{index}({value})", f"_encode{index}({value})"
+    raise ValueError(f"converter {converter!r} can't be used on field '{name}' of type '{code}'")
+
+
+def _define(source: str, namespace: dict, filename: str, function_name: str):
+    """Compile generated source, keeping it in linecache so tracebacks can show it."""
+    linecache.cache[filename] = (len(source), None, source.splitlines(True), filename)
+    exec(compile(source, filename, 'exec'), namespace)
+    function = namespace[function_name]
+    function.__source__ = source
+    return function
+
+
+@functools.lru_cache(maxsize=256)
+def _generate_codec(compiled: CompiledFormat, converters: tuple, record: bool, packer: bool):
+    """
+    Generate (once per compiled format and converter spec) a specialized unpack or pack function.
+
+    The cache is keyed on the CompiledFormat rather than the format string, whose meaning
+    can change when a registered format name is reused.
+    """
+    struct_ = compiled.struct
+    namespace = {'_unpack_from': struct_.unpack_from, '_pack': struct_.pack, '_bytes': bytes,
+                 '_tuple_new': tuple.__new__, '_Record': compiled.record}
+
+    variables = [f"v{index}" for index in range(len(compiled.field_names))]
+    unpack_exprs = list(variables)
+    pack_exprs = list(variables)
+    for index, converter in converters:
+        unpack_exprs[index], pack_exprs[index] = _converter_exprs(compiled, index, converter, namespace)
+
+    if packer:
+        missing = [compiled.field_names[index] for index, expr in enumerate(pack_exprs) if expr is None]
+        if missing:
+            raise ValueError(f"fields {missing} have a decode only converter and can't be packed")
+        source = (f"def pack({', '.join(variables)}):\n"
+                  f"    return _pack({', '.join(pack_exprs)})\n")
+        function_name = 'pack'
+    else:
+        result = f"({', '.join(unpack_exprs)}{',' if len(unpack_exprs) == 1 else ''})"
+        if record:
+            result = f"_tuple_new(_Record, {result})"
+        source = "def unpack(buffer, offset=0):\n"
+        if variables:
+            source += f"    {', '.join(variables)}{',' if len(variables) == 1 else ''} = _unpack_from(buffer, offset)\n"
+        else:
+            source += "    _unpack_from(buffer, offset)\n"
+        source += f"    return {result}\n"
+        function_name = 'unpack'
+
+    filename = f"<libstruct {function_name} {compiled.human_format!r} #{_generate_codec.cache_info().currsize}>"
+    return _define(source, namespace, filename, function_name)
+
+
+class RecordView:
+    """
+    Lazy view of one record inside a buffer.
+
+    Nothing is decoded up front, each field is unpacked from the buffer the first time it
+    is read (by name, attribute or index) and then cached.  The view holds a memoryview of
+    the buffer, so changes made to the buffer after a field has been read are not seen.
+    """
+
+    __slots__ = ('_compiled', '_buffer', '_offset', '_cache')
+
+    def __init__(self, compiled: CompiledFormat, buffer, offset: int = 0):
+        self._compiled = compiled
+        self._buffer = memoryview(buffer)
+        self._offset = offset
+        self._cache = {}
+        if offset < 0 or self._buffer.nbytes < offset + compiled.struct.size:
+            raise struct.error(f"buffer too small for a {compiled.struct.size} byte record at offset {offset}")
+
+    def __getitem__(self, name_or_index):
+        index = self._compiled.value_index(name_or_index)
+        try:
+            return self._cache[index]
+        except KeyError:
+            pass
+        value = self._cache[index] = self._compiled.values[index].struct.unpack_from(
+            self._buffer, self._offset + self._compiled.values[index].offset)[0]
+        return value
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __len__(self):
+        return len(self._compiled.values)
+
+    def __iter__(self):
+        return (self[index] for index in range(len(self)))
+
+    def __repr__(self):
+        return f"RecordView({self._compiled.human_format!r}, offset={self._offset})"
+
+
+class AsyncRecordWriter:
+    """
+    Batch packed records for an asyncio.StreamWriter.
+
+    Records are packed with pack_into straight into one reused block and handed to the
+    writer in a single write() when the block fills up or flush_interval seconds after the
+    first unflushed record, whichever comes first.  write() never blocks, call drain() (or
+    flush()) from time to time to apply the writer's flow control.
+
+    Use as an async context manager to flush whatever is left on exit.
+    """
+
+    def __init__(self, libstruct: 'LibStruct', writer, flush_interval: float = 0.05,
+                 buffer_size: int = 64 * 1024):
+        if flush_interval < 0:
+            raise ValueError("flush_interval must be >= 0")
+        self._struct = libstruct._compiled.struct
+        self._writer = writer
+        self.flush_interval = flush_interval
+        self._block = bytearray(max(buffer_size // self._struct.size, 1) * self._struct.size)
+        self._filled = 0
+        self._timer = None
+
+    def write(self, *data):
+        """Pack one record into the pending block."""
+        if self._filled == len(self._block):
+            self._write_block()
+        self._struct.pack_into(self._block, self._filled, *data)
+        self._filled += self._struct.size
+        if self._timer is None:
+            import asyncio  # Only asyncio users pay for importing it.
+            self._timer = asyncio.get_running_loop().call_later(self.flush_interval, self._write_block)
+
+    def _write_block(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._filled:
+            self._writer.write(self._block[:self._filled])
+            self._filled = 0
+
+    async def drain(self):
+        """Wait for the writer's buffer to drain, without forcing pending records out."""
+        await self._writer.drain()
+
+    async def flush(self):
+        """Write every pending record now and wait for the writer to drain."""
+        self._write_block()
+        await self._writer.drain()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.flush()
+
+
+def _match_test(expected):
+    """Turn a scan condition into a test of one value: a callable, a set or range to look in, or a value."""
+    if callable(expected):
+        return expected
+    if isinstance(expected, (set, frozenset, range)):
+        return expected.__contains__
+    return functools.partial(operator.eq, expected)
+
+
+class RecordScan:
+    """
+    Iterator over the records of a LibStruct.scan that match its conditions.
+
+    scanned and matched count the records looked at and yielded so far, so they are
+    totals once the iteration is exhausted.
+    """
+
+    __slots__ = ('scanned', 'matched', '_records')
+
+    def __init__(self, records):
+        self.scanned = 0
+        self.matched = 0
+        self._records = records(self)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._records)
+
+    def __repr__(self):
+        return f"RecordScan(scanned={self.scanned}, matched={self.matched})"
+
+
 class LibStruct:
 
     def __init__(self, human_readable_format: str):
-        self.format = self.decode_human_readable_fmt(human_readable_format)
+        self._compiled = format_cache.get(human_readable_format)
+        self.format = self._compiled.format
         self.human_format = human_readable_format
         self.bytes = b''
 
+        # Bound methods of the shared struct.Struct, so pack/unpack skip struct's own format lookup.
+        # Formats struct rejects fall back to the module functions, which raise on first use.
+        if self._compiled._struct is not None:
+            self._pack = self._compiled.struct.pack
+            self._unpack = self._compiled.struct.unpack
+        else:
+            self._pack = functools.partial(struct.pack, self.format)
+            self._unpack = functools.partial(struct.unpack, self.format)
+
     def __repr__(self):
         return f"LibStruct(human_readable_format: '{self.human_format}' struct_format: '{self.format}')"
 
-    def to_ascii(self, unprintable_char='.'):
-        """Sometimes looking at strings makes sense."""
-        return ''.join(chr(byte_) if 32 <= byte_ < 127 else unprintable_char for byte_ in self.bytes)
+    def to_ascii(self, unprintable_char='.', buffer=None, start: int = 0, length: int = None):
+        """
+        Sometimes looking at strings makes sense.
+
+        Printable ASCII is shown as is and every other byte as unprintable_char.  The work is
+        a single bytes.translate() with a table cached per replacement character.
+
+        Args:
+            unprintable_char: Replacement for unprintable bytes, may be any string.
+            buffer: bytes, bytearray, memoryview, mmap... to show, defaults to self.bytes.
+            start: Offset of the first byte to show.
+            length: Number of bytes to show, None shows everything after start.
+        """
+        with memoryview(self.bytes if buffer is None else buffer) as view, view.cast('B') as data:
+            stop = len(data) if length is None else min(start + length, len(data))
+            window = data[start:stop].tobytes()
+        if len(unprintable_char) == 1 and ord(unprintable_char) < 256:
+            return window.translate(_ascii_table(unprintable_char)).decode('latin-1')
+        return window.decode('latin-1').translate(_ascii_str_table(unprintable_char))
 
     def as_hex(self,
                columns: int = None,
@@ -24,13 +1343,15 @@ class LibStruct:
                addr_format: str = "{:02X} ",
                hex_format: str = "{:02X}",
                show_ascii: bool = False,
-               show_address: bool = True):
+               show_address: bool = True,
+               buffer=None):
         """
         Converts the byte array into a formatted string of hexadecimal byte values using the
         hexout package, using reasonable defaults for this application.
 
         Args:
-          See hexout library for more information.
+          buffer: bytes, bytearray, memoryview, mmap... to show, defaults to self.bytes.
+          See hexout library for more information on the other arguments.
 
         Returns:
             str: A string representing the byte array in hexadecimal, optionally with memory addresses.
@@ -44,81 +1365,1192 @@ class LibStruct:
                            hex_format=hex_format,
                            show_ascii=show_ascii)
 
-        return ho.as_hex(self.bytes)
+        if buffer is None:
+            return ho.as_hex(self.bytes)
+        with memoryview(buffer) as view, view.cast('B') as data:
+            return ho.as_hex(data)
+
+    @property
+    def size(self) -> int:
+        """Size in bytes of one packed record."""
+        return self._compiled.size
+
+    @property
+    def fields(self) -> tuple[FieldLayout, ...]:
+        """Compiled layout of every part of the format: type, repeat, offset, size and alignment."""
+        return self._compiled.fields
+
+    def iter_hex(self, source=None, **kwargs):
+        """Stream a hex dump of source (default self.bytes) line by line, see the module level iter_hex."""
+        return iter_hex(self.bytes if source is None else source, **kwargs)
 
     def pack(self, *data) -> bytes:
-        self.bytes = struct.pack(self.format, *data)
+        self.bytes = self._pack(*data)
         return self.bytes
 
     def unpack(self, data: bytes) -> list:
-        return struct.unpack(self.format, data)
+        return self._unpack(data)
+
+    def pack_into(self, buffer, offset: int, *data) -> int:
+        """
+        Pack data directly into a writable buffer (bytearray, memoryview, writable mmap).
+
+        Nothing is copied and self.bytes is left untouched.
+
+        Returns:
+            int: The offset just past the packed record, so calls can be chained.
+        """
+        struct_ = self._compiled.struct
+        struct_.pack_into(buffer, offset, *data)
+        return offset + struct_.size
+
+    def pack_many(self, records, out=None, offset: int = 0, file=None, block_size: int = DEFAULT_BLOCK_SIZE):
+        """
+        Pack many records into one buffer, or stream them to a file.
+
+        Every record is packed with pack_into, so no bytes object is created per record and
+        self.bytes is left untouched.
+
+        Args:
+            records: Iterable of value sequences, one per record.
+            out: Writable buffer to pack into starting at offset.  When neither out nor file
+                 is given a bytearray of exactly the right size is allocated.
+            offset: Byte offset in out of the first record.
+            file: Binary file object.  Records are packed into one reused block of about
+                  block_size bytes that is written out whenever it fills up.
+            block_size: Size of the block used when writing to a file.
+
+        Returns:
+            The buffer holding the records, or the number of bytes written when file is given.
+
+        Raises:
+            struct.error: If out is too small for all the records.
+        """
+        struct_ = self._compiled.struct
+        pack_into = struct_.pack_into
+        size = struct_.size
+
+        if file is not None:
+            block = bytearray(max(block_size // size, 1) * size)
+            written = filled = 0
+            for values in records:
+                if filled == len(block):
+                    file.write(block)
+                    written += filled
+                    filled = 0
+                pack_into(block, filled, *values)
+                filled += size
+            if filled:
+                with memoryview(block) as view, view[:filled] as tail:
+                    file.write(tail)
+                written += filled
+            return written
+
+        if not hasattr(records, '__len__'):
+            records = list(records)
+        needed = offset + len(records) * size
+        if out is None:
+            out = bytearray(needed)
+        else:
+            with memoryview(out) as view:
+                if view.nbytes < needed:
+                    raise struct.error(f"pack_many requires a buffer of at least {needed} bytes")
+        for values in records:
+            pack_into(out, offset, *values)
+            offset += size
+        return out
+
+    def unpack_from(self, buffer, offset: int = 0) -> tuple[tuple, int]:
+        """
+        Unpack one record starting at offset without slicing the buffer.
+
+        The buffer only needs to hold at least one record past offset.
+
+        Returns:
+            tuple: The unpacked values and the offset just past the record.
+        """
+        struct_ = self._compiled.struct
+        return struct_.unpack_from(buffer, offset), offset + struct_.size
+
+    async def aiter_unpack(self, reader, chunk_size: int = 64 * 1024):
+        """
+        Asynchronously iterate over records read from an asyncio.StreamReader.
+
+        Data is read in chunks of up to chunk_size bytes into one reused buffer and the
+        whole records in it are decoded with a single iter_unpack over a memoryview, so no
+        record is sliced out of the buffer.
+
+        Raises:
+            asyncio.IncompleteReadError: If the stream ends part way through a record.
+        """
+        iter_unpack = self._compiled.struct.iter_unpack
+        size = self.size
+        buffer = bytearray()
+        while chunk := await reader.read(chunk_size):
+            buffer += chunk
+            whole = len(buffer) - len(buffer) % size
+            if whole:
+                for values in iter_unpack(memoryview(buffer)[:whole]):
+                    yield values
+                # The memoryview is gone with the loop, so the buffer can shrink in place.
+                del buffer[:whole]
+        if buffer:
+            import asyncio
+            raise asyncio.IncompleteReadError(bytes(buffer), size)
+
+    def stream_writer(self, writer, flush_interval: float = 0.05,
+                      buffer_size: int = 64 * 1024) -> AsyncRecordWriter:
+        """Return an AsyncRecordWriter that batches records of this format onto writer."""
+        return AsyncRecordWriter(self, writer, flush_interval, buffer_size)
+
+    def parallel_unpack(self, path, workers: int = None, chunk_size: int = 64 * 1024 * 1024,
+                        reduce=None, ordered: bool = True, offset: int = 0, count: int = None):
+        """
+        Decode a large file of back to back records in worker processes.
+
+        The file is split into chunks of whole records.  Each worker memory maps the file and
+        decodes its own chunk, so no file data is pickled and sent to the workers.  Only a
+        few chunks per worker are in flight at a time, so memory stays bounded when the
+        caller consumes results slowly.
+
+        Args:
+            path: Path of the file to decode.
+            workers: Number of worker processes, defaults to the number of CPUs.
+            chunk_size: Approximate number of bytes decoded per task, rounded down to a
+                        whole number of records.
+            reduce: Optional picklable callable run in the worker on the iterator of a
+                    chunk's records.  Its return value is sent back instead of the records.
+            ordered: Yield results in file order.  When False results are yielded as chunks
+                     complete, which keeps all workers busy.
+            offset: Byte offset of the first record.
+            count: Number of records to decode, None decodes every record after offset.
+
+        Yields:
+            Each record tuple, or when reduce is given one reduced result per chunk.
+
+        Raises:
+            struct.error: If the file does not hold a whole number of records.
+        """
+        path = os.fspath(path)
+        record_size = self.size
+        end = os.path.getsize(path)
+        if count is not None:
+            end = min(end, offset + count * record_size)
+        if record_size < 1 or (end - offset) % record_size:
+            raise struct.error(f"{path} does not hold a whole number of {record_size} byte records")
+        if end <= offset:
+            return
+
+        workers = workers or os.cpu_count() or 1
+        chunk = max(chunk_size // record_size, 1) * record_size
+        ranges = ((start, min(start + chunk, end)) for start in range(offset, end, chunk))
+
+        pool = ProcessPoolExecutor(max_workers=workers)
+        try:
+            pending = deque()
+
+            def submit_next():
+                span = next(ranges, None)
+                if span is not None:
+                    pending.append(pool.submit(_unpack_file_range, path, self.format, *span, reduce))
+
+            for _ in range(2 * workers):
+                submit_next()
+
+            while pending:
+                if ordered:
+                    future = pending.popleft()
+                else:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    future = done.pop()
+                    pending.remove(future)
+                result = future.result()
+                submit_next()
+                if reduce is None:
+                    yield from result
+                else:
+                    yield result
+        finally:
+            pool.shutdown(cancel_futures=True)
+
+    @property
+    def field_names(self) -> tuple[str, ...]:
+        """Names of the unpacked values, from 'type:name' parts of the format."""
+        return self._compiled.field_names
+
+    @property
+    def record_class(self) -> type:
+        """
+        The record class generated for this format.
+
+        It is a namedtuple, so records are tuples with named attribute access and no
+        per record __dict__.  The class is built once per format and shared.
+        """
+        return self._compiled.record
+
+    def unpack_record(self, data) -> tuple:
+        """Unpack one record into an instance of record_class."""
+        return self._compiled.record._make(self._unpack(data))
+
+    def pack_record(self, record) -> bytes:
+        """
+        Pack a record.
+
+        Args:
+            record: An instance of record_class, any sequence of values in field order or a
+                    mapping of field name to value.
+        """
+        if isinstance(record, Mapping):
+            record = [record[name] for name in self.field_names]
+        return self.pack(*record)
+
+    def _converter_spec(self, converters) -> tuple:
+        """Normalize {name or index: converter} into a hashable, index ordered tuple."""
+        compiled = self._compiled
+        spec = {compiled.value_index(key): converter for key, converter in (converters or {}).items()}
+        return tuple(sorted(spec.items()))
+
+    def make_unpacker(self, converters: dict = None, record: bool = False, debug: bool = False):
+        """
+        Generate a function that unpacks a record and converts its fields in one call.
+
+        The function is generated with exec() for this format and converter spec, so there
+        is no second pass over the unpacked tuple, and it is cached so asking again is cheap.
+
+        Args:
+            converters: Field name or value index to converter, one of 'strip', 'str',
+                        ('str', encoding), 'int', a scale factor, a callable or a
+                        (decode, encode) pair of callables.
+            record: Return instances of record_class instead of plain tuples.
+            debug: Print the generated source to stderr.  It is also always available as
+                   the function's __source__ attribute.
+
+        Returns:
+            A function unpack(buffer, offset=0) returning the converted values.
+        """
+        function = _generate_codec(self._compiled, self._converter_spec(converters), record, False)
+        if debug:
+            print(function.__source__, file=sys.stderr)
+        return function
+
+    def make_packer(self, converters: dict = None, debug: bool = False):
+        """
+        Generate a function that converts field values and packs them in one call.
+
+        The inverse of make_unpacker with the same converters: strings are encoded, scaled
+        values divided by their scale (and rounded for integer fields) and ints turned
+        back into chars.  Plain callables only decode, fields using them can't be packed.
+
+        Returns:
+            A function pack(*values) returning the packed bytes.
+        """
+        function = _generate_codec(self._compiled, self._converter_spec(converters), False, True)
+        if debug:
+            print(function.__source__, file=sys.stderr)
+        return function
+
+    def nest(self, values) -> tuple:
+        """
+        Regroup the flat values of one record into the nested shape of the format.
+
+        Registered formats used in this format become sub-records, repeated ones tuples of
+        sub-records, other values are kept as they are.  Unpacking stays one flat call, the
+        regrouping is only done when asked for.
+
+            register_format("sample", "little_endian int16:t float:v")
+            sl = LibStruct("little_endian uint32:seq 16*sample:samples")
+            msg = sl.nest(sl.unpack(data))   # msg.samples[3].v
+        """
+        return self._compiled.nest(values)
+
+    def unpack_nested(self, data) -> tuple:
+        """Unpack one record and regroup it with nest()."""
+        return self._compiled.nest(self._unpack(data))
+
+    @property
+    def bitfield_names(self) -> tuple[str, ...]:
+        """Names of every bitfield in the format, in format order."""
+        return self._compiled.bits_record._fields
+
+    def unpack_bits(self, buffer, offset: int = 0) -> tuple:
+        """
+        Decode every bitfield of the record at offset.
+
+        The integers holding bitfields unpack as plain values everywhere else, this
+        splits them with the shift and mask table compiled from the format.
+
+        Returns:
+            A namedtuple with one field per bitfield.
+        """
+        compiled = self._compiled
+        values = compiled.struct.unpack_from(buffer, offset)
+        return compiled.bits_record._make([(values[index] >> bit.shift) & bit.mask
+                                           for index, bit in compiled.bitfields])
+
+    def unpack_bits_columns(self, buffer) -> dict:
+        """
+        Decode every bitfield of every record in a buffer of back to back records.
+
+        The integers holding bitfields are gathered into columns like unpack_columns, then
+        each bitfield is shifted and masked out of the whole column at once, with NumPy
+        when it is installed.
+
+        Returns:
+            dict: Bitfield name to an unsigned array.array column.
+        """
+        compiled = self._compiled
+        size = compiled.size
+        columns = {}
+        words = {}
+        with memoryview(buffer) as view, view.cast('B') as data:
+            if len(data) % size:
+                raise struct.error(f"columnar unpacking requires a buffer of a multiple of {size} bytes")
+            for index, bit in compiled.bitfields:
+                if index not in words:
+                    words[index] = _column(data, compiled.values[index], size, compiled.byte_order or '@')
+                columns[bit.name] = _extract_bits(words[index], bit)
+        return columns
+
+    def pack_bits(self, name_or_index, **bits) -> int:
+        """
+        Build the integer value holding bitfields from the bitfield values.
+
+        Args:
+            name_or_index: The field holding the bitfields.
+            bits: Bitfield name to value, missing bitfields are 0.
+
+        Raises:
+            ValueError: For unknown bitfields and values that don't fit their width.
+        """
+        compiled = self._compiled
+        index = compiled.value_index(name_or_index)
+        word = 0
+        for bit_index, bit in compiled.bitfields:
+            if bit_index != index or bit.name not in bits:
+                continue
+            value = bits.pop(bit.name)
+            if not 0 <= value <= bit.mask:
+                raise ValueError(f"{value} does not fit the {bit.width} bit field '{bit.name}'")
+            word |= value << bit.shift
+        if bits:
+            raise ValueError(f"field '{compiled.field_names[index]}' has no bitfields named {sorted(bits)}")
+
+        # Signed integers hold the bits as two's complement.
+        struct_ = compiled.values[index].struct
+        top_bit = 1 << (struct_.size * 8 - 1)
+        if struct_.format[-1] in 'bhiq' and word & top_bit:
+            word -= top_bit << 1
+        return word
+
+    @property
+    def offsets(self) -> tuple[ValueLayout, ...]:
+        """Byte offset (and single value struct.Struct) of every unpacked value."""
+        return self._compiled.values
+
+    def view(self, buffer, offset: int = 0) -> RecordView:
+        """Return a RecordView that decodes fields of the record at offset on demand."""
+        return RecordView(self._compiled, buffer, offset)
+
+    def unpack_field(self, name_or_index, buffer, offset: int = 0):
+        """
+        Decode a single field of the record starting at offset.
+
+        Args:
+            name_or_index: The field name or the index of the value in the unpacked tuple.
+            buffer: Any object supporting the buffer protocol.
+            offset: Byte offset of the record in the buffer.
+        """
+        compiled = self._compiled
+        value = compiled.values[compiled.value_index(name_or_index)]
+        return value.struct.unpack_from(buffer, offset + value.offset)[0]
+
+    def unpack_columns(self, buffer) -> dict:
+        """
+        Decode a buffer of back to back records into one column per field.
+
+        Numeric fields become typed array.array columns, bool fields are 0/1 'B' arrays, and
+        char and string fields become lists of bytes.  Columns are built from the raw bytes
+        with strided copies, no tuple is created per record and NumPy is not needed.
+
+        Returns:
+            dict: Field name (see field_names) to column, in field order.
+
+        Raises:
+            struct.error: If the buffer does not hold a whole number of records.
+        """
+        size = self.size
+        with memoryview(buffer) as view, view.cast('B') as data:
+            if len(data) % size:
+                raise struct.error(f"columnar unpacking requires a buffer of a multiple of {size} bytes")
+            byte_order = self._compiled.byte_order or '@'
+            return {value.name: _column(data, value, size, byte_order) for value in self._compiled.values}
+
+    def byteswap_buffer(self, buffer, target_endian: str):
+        """
+        Convert a buffer of back to back records to another byte order in place.
+
+        Every multi-byte value is reversed using the compiled layout, with one structured
+        NumPy byteswap when NumPy is installed, or with strided swaps of each byte lane.
+        Strings, padding and single byte values are left untouched.  Afterwards the buffer
+        holds records of this format with its byte order replaced by target_endian.
+
+        Args:
+            buffer: A writable buffer (bytearray, writable memoryview or mmap...).
+            target_endian: 'little_endian', 'big_endian', 'network' or 'native'.
+
+        Raises:
+            ValueError: For an unknown target, or a format without an explicit byte order.
+            struct.error: If the buffer does not hold a whole number of records.
+        """
+        if target_endian not in _ENDIAN_FLAGS:
+            raise ValueError(f"unknown byte order '{target_endian}', expected one of {', '.join(_ENDIAN_FLAGS)}")
+        byte_order = self._compiled.byte_order
+        if byte_order in ('', '@'):
+            raise ValueError("byteswap_buffer needs a format with an explicit byte order")
+        if _is_little_endian(byte_order) == _is_little_endian(_ENDIAN_FLAGS[target_endian]):
+            return
+
+        size = self.size
+        with memoryview(buffer) as view, view.cast('B') as data:
+            if len(data) % size:
+                raise struct.error(f"byte swapping requires a buffer of a multiple of {size} bytes")
+            np = _numpy()
+            if np is not None and 'p' not in self.format:
+                np.frombuffer(data, dtype=self.dtype).byteswap(inplace=True)
+                return
+            for value in self._compiled.values:
+                if value.struct.format[-1] not in 'sp' and value.struct.size > 1:
+                    _swap_lanes(data, value.offset, value.struct.size, size)
+
+    @property
+    def dtype(self):
+        """
+        NumPy structured dtype with the same memory layout as one record.
+
+        Byte order, padding, repeats (as sub-arrays) and fixed size strings are honoured.
+        Pascal strings have no NumPy equivalent and raise a ValueError.
+        """
+        return self._compiled.dtype
+
+    def unpack_array(self, buffer, count: int = -1, offset: int = 0):
+        """
+        Decode many records at once into a NumPy structured array.
+
+        The array is a view on the buffer, nothing is copied.  It is read only when the
+        buffer is (e.g. bytes).
+
+        Args:
+            buffer: Any object supporting the buffer protocol.
+            count: Number of records to decode, -1 decodes every record after offset.
+            offset: Byte offset of the first record.
+        """
+        return _require_numpy().frombuffer(buffer, dtype=self.dtype, count=count, offset=offset)
+
+    def pack_array(self, array) -> bytes:
+        """
+        Encode a NumPy array of records into bytes in a single call.
+
+        Structured arrays with a different dtype are converted field by field, in order.
+        Padding is always written as zero bytes, matching struct.
+        """
+        np_ = _require_numpy()
+        dtype = self.dtype
+        array = np_.asarray(array)
+        if array.dtype != dtype or sum(field[0].itemsize for field in dtype.fields.values()) != dtype.itemsize:
+            converted = np_.zeros(array.shape, dtype=dtype)
+            converted[...] = array
+            array = converted
+        return array.tobytes()
+
+    def iter_unpack(self, source, block_size: int = DEFAULT_BLOCK_SIZE, compression: str = None):
+        """
+        Iterate over back to back records, yielding one tuple per record.
+
+        Args:
+            source: bytes, bytearray, memoryview or mmap holding whole records, a binary
+                    file object opened for reading or a path.
+            block_size: Approximate number of bytes read from a file at a time.  Blocks are
+                        always a whole number of records.
+            compression: 'gzip', 'bz2', 'lzma' or 'auto' (detect from the header) to
+                         decompress on the fly.  None decompresses only paths with a
+                         compressed suffix, see open_capture.
+
+        Yields:
+            tuple: The unpacked values of each record.
+
+        Raises:
+            struct.error: If the data does not hold a whole number of records.
+        """
+        iter_unpack = self._compiled.struct.iter_unpack
+        for block in _iter_record_blocks(source, self.size, block_size, compression):
+            yield from iter_unpack(block)
+
+    def scan(self, source, where: dict = None, predicate=None, keys=None, record: bool = False,
+             block_size: int = DEFAULT_BLOCK_SIZE, compression: str = None) -> RecordScan:
+        """
+        Iterate over the records matching conditions on a few key fields.
+
+        Only the key fields of every record are decoded, a block at a time with the strided
+        column copies of unpack_columns.  Records are fully unpacked only when they match.
+
+        Args:
+            source: bytes, bytearray, memoryview or mmap holding whole records, or a binary
+                    file object opened for reading.
+            where: Field name (or index) to condition.  A condition is a callable testing the
+                   value, a set or range the value must be in, or a value it must equal.
+            predicate: Called with the values of the keys fields, in order, the record matches
+                       when it returns true.
+            keys: Fields passed to predicate.
+            record: Yield records (see record_class) rather than tuples.
+            block_size: Approximate number of bytes examined at a time.
+            compression: How to decompress source, see iter_unpack.
+
+        Returns:
+            RecordScan: Iterator over the matching records, with scanned and matched counts.
+
+        Raises:
+            struct.error: If the data does not hold a whole number of records.
+        """
+        compiled = self._compiled
+        values = compiled.values
+        conditions = [(compiled.value_index(name), _match_test(expected)) for name, expected in (where or {}).items()]
+        key_indexes = [compiled.value_index(name) for name in keys or ()]
+        if predicate is not None and not key_indexes:
+            raise ValueError("scan needs the keys passed to predicate")
+
+        size = compiled.size
+        unpack_from = compiled.struct.unpack_from
+        make = compiled.record._make if record else None
+        byte_order = compiled.byte_order or '@'
+
+        def select(window, count):
+            """Return the indexes of the matching records of one window, decoding only key columns."""
+            columns = {}
+
+            def column(index):
+                if index not in columns:
+                    columns[index] = _column(window, values[index], size, byte_order)
+                return columns[index]
+
+            candidates = range(count)
+            for index, test in conditions:
+                key = column(index)
+                candidates = [i for i in candidates if test(key[i])]
+            if predicate is not None and candidates:
+                key_columns = [column(index) for index in key_indexes]
+                candidates = [i for i in candidates if predicate(*[key[i] for key in key_columns])]
+            return candidates
+
+        def matching(scan):
+            window_size = max(block_size // size, 1) * size
+            for block in _iter_record_blocks(source, size, block_size, compression):
+                with memoryview(block) as view, view.cast('B') as data:
+                    if len(data) % size:
+                        raise struct.error(f"scanning requires a buffer of a multiple of {size} bytes")
+                    for start in range(0, len(data), window_size):
+                        with data[start:start + window_size] as window:
+                            count = len(window) // size
+                            candidates = select(window, count)
+                            scan.scanned += count
+                            for i in candidates:
+                                scan.matched += 1
+                                found = unpack_from(window, i * size)
+                                yield make(found) if make else found
+
+        return RecordScan(matching)
 
     @staticmethod
     def decode_human_readable_fmt(format_string):
-        struct_format_dict = {
-            "bool": "?",
-            "byte": "b",
-            "int8": "b",
-            "ubyte": "B",
-            "uint8": "B",
-            "int16": "h",
-            "uint16": "H",
-            "int32": "i",
-            "uint32": "I",
-            "int64": "q",
-            "uint64": "Q",
-            "float": "f",
-            "double": "d",
-            "char": "c",
-            "s": "s",
-            "string": "s",
-            "str": "s",
-            "p": "p",
-            "pascal": "p",
-            "P": "P",
-            "pointer": "P",
-            "padding": "x",
-            "pad": 'x',
-        }
-
-        endian_flag = {
-            "little_endian": "<",
-            "big_endian": ">",
-            "network": "!",
-            "native": "="
-        }
-
-        # Initialize result
-        result = ""
-
-        # Split string into parts
-        parts = format_string.split()
-
-        # Handle endian-ness
-        if parts[0] in endian_flag:
-            result += endian_flag[parts.pop(0)]
-
-        # Handle types and repetition
-        for part in parts:
-            # If '*' exists, there is repetition
-            if '*' in part:
-                repeat, type_ = part.split('*')
-
-                # Ignore if padding value is not a digit or padding itself
-                if repeat.isdigit() or type_ == "padding":
-                    struct_format = struct_format_dict[type_]
-
-                    # If repetition is number
-                    if repeat.isdigit():
-                        repeat = int(repeat)
-                        result += str(repeat) + struct_format
-                    else:  # If padding itself
-                        result += struct_format
-            else:  # If no '*', type only
-                struct_format = struct_format_dict.get(part, "")
-
-                # If type exists in dict
-                if struct_format:
-                    result += struct_format
-
-        return result
+        """
+        Return the struct format for a human readable format string.
+
+        Raises:
+            FormatError: If the format string is not valid.
+        """
+        return compile_format(format_string).format
+
+    @staticmethod
+    def decode_field_names(format_string) -> tuple[str, ...]:
+        """
+        Return one name per unpacked value.
+
+        Names come from 'type:name' parts.  A named repeat such as '3*int32:xyz' names its
+        values xyz_0, xyz_1 and xyz_2, and unnamed values are called field_<index>.
+        Strings and padding follow struct, a string is one value and padding is none.
+        """
+        return compile_format(format_string).field_names
+
+
+class FrozenLibStruct(LibStruct):
+    """
+    Immutable, stateless LibStruct that can be shared by any number of threads.
+
+    pack() returns the packed bytes without storing them, and as_hex, to_ascii and iter_hex
+    require the buffer to show (a keyword argument for as_hex and to_ascii, so the other
+    arguments keep their LibStruct positions), so nothing is retained between calls and one
+    instance can serve a whole thread pool.  Attributes cannot be set after construction.
+    All other methods already work only on their arguments and the shared compiled format.
+    """
+
+    def __init__(self, human_readable_format: str):
+        super().__init__(human_readable_format)
+        object.__setattr__(self, '_frozen', True)
+
+    def __setattr__(self, name, value):
+        if getattr(self, '_frozen', False):
+            raise AttributeError(f"{type(self).__name__} is immutable")
+        super().__setattr__(name, value)
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __repr__(self):
+        return f"FrozenLibStruct(human_readable_format: '{self.human_format}' struct_format: '{self.format}')"
+
+    def pack(self, *data) -> bytes:
+        return self._pack(*data)
+
+    def as_hex(self, columns: int = None, bytes_per_column=1, base_address: int = 0, addr_format: str = "{:02X} ",
+               hex_format: str = "{:02X}", show_ascii: bool = False, show_address: bool = True, *, buffer):
+        """Hex dump of buffer, which is required as nothing is stored.  See LibStruct.as_hex."""
+        return super().as_hex(columns, bytes_per_column, base_address, addr_format, hex_format, show_ascii,
+                              show_address, buffer=buffer)
+
+    def to_ascii(self, unprintable_char='.', *, buffer, start: int = 0, length: int = None):
+        """ASCII view of buffer, which is required as nothing is stored.  See LibStruct.to_ascii."""
+        return super().to_ascii(unprintable_char, buffer=buffer, start=start, length=length)
+
+    def iter_hex(self, source, **kwargs):
+        """Stream a hex dump of source line by line, see the module level iter_hex."""
+        return iter_hex(source, **kwargs)
+
+
+class RecordIndex:
+    """
+    Persistent offset index of a file of mixed records.
+
+    Every record in the file is a type byte followed by a record of the LibStruct that type
+    selects.  The file is walked once and the offset and type of every record is kept in a
+    sidecar file of little endian uint64 entries (offset << 8 | type), so later opens only
+    walk records appended since.  The data file is memory mapped, record(i) is O(1).
+
+    Example:
+        with RecordIndex("capture.bin", {1: header, 2: sample}) as index:
+            record_type, values = index.record(1000)
+    """
+
+    _ENTRY = struct.Struct('<Q')
+
+    def __init__(self, path, formats: dict, index_path=None):
+        """
+        Args:
+            path: The data file.
+            formats: Type byte to LibStruct (or format string) of the record that follows it.
+            index_path: The sidecar index file, path + '.idx' by default.
+        """
+        self.path = os.fspath(path)
+        self.index_path = os.fspath(index_path) if index_path is not None else self.path + '.idx'
+        self.formats = {record_type: fmt if isinstance(fmt, LibStruct) else LibStruct(fmt)
+                        for record_type, fmt in formats.items()}
+        for record_type in self.formats:
+            if not 0 <= record_type <= 0xFF:
+                raise ValueError(f"record type {record_type} does not fit the type byte")
+        self._structs = {record_type: fmt._compiled.struct for record_type, fmt in self.formats.items()}
+
+        self._entries = array.array('Q')
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'rb') as index_file:
+                data = index_file.read()
+            # An append interrupted part way through an entry leaves a partial entry behind.
+            self._entries.frombytes(data[:len(data) - len(data) % self._ENTRY.size])
+            if sys.byteorder == 'big':
+                self._entries.byteswap()
+
+        self._file = open(self.path, 'rb')
+        self._mmap = None
+        self._mapped = 0
+        self.update()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return f"RecordIndex({self.path!r}, records={len(self)})"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+
+    def _remap(self) -> int:
+        """Map the whole data file again if it grew, and return its size."""
+        size = os.fstat(self._file.fileno()).st_size
+        if size != self._mapped:
+            if self._mmap is not None:
+                self._mmap.close()
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+            self._mapped = size
+        return size
+
+    def _end(self) -> int:
+        """Offset just past the last indexed record."""
+        if not self._entries:
+            return 0
+        entry = self._entries[-1]
+        return (entry >> 8) + 1 + self._structs[entry & 0xFF].size
+
+    def update(self) -> int:
+        """
+        Index the records appended to the data file since the last update.
+
+        A record cut short at the end of the file is left for the next update.
+
+        Returns:
+            int: The number of records added to the index.
+
+        Raises:
+            ValueError: For a type byte without a format, or an index that doesn't match the file.
+        """
+        size = self._remap()
+        position = self._end()
+        if position > size:
+            raise ValueError(f"index {self.index_path!r} covers {position} bytes but {self.path!r} has {size}")
+
+        mm = self._mmap
+        structs = self._structs
+        new = array.array('Q')
+        while position < size:
+            record_type = mm[position]
+            try:
+                end = position + 1 + structs[record_type].size
+            except KeyError:
+                raise ValueError(f"unknown record type {record_type} at offset {position}") from None
+            if end > size:
+                break
+            new.append(position << 8 | record_type)
+            position = end
+
+        if new:
+            self._entries.extend(new)
+            if sys.byteorder == 'big':
+                new.byteswap()
+            with open(self.index_path, 'ab') as index_file:
+                new.tofile(index_file)
+        return len(new)
+
+    def offset(self, i: int) -> int:
+        """Byte offset of the type byte of record i."""
+        return self._entries[i] >> 8
+
+    def record(self, i: int) -> tuple[int, tuple]:
+        """Return (type, values) of record i."""
+        entry = self._entries[i]
+        record_type = entry & 0xFF
+        return record_type, self._structs[record_type].unpack_from(self._mmap, (entry >> 8) + 1)
+
+    def records(self, start: int = 0, stop: int = None):
+        """Yield (type, values) of records start to stop, like record() for each."""
+        mm = self._mmap
+        structs = self._structs
+        for entry in self._entries[start:stop]:
+            record_type = entry & 0xFF
+            yield record_type, structs[record_type].unpack_from(mm, (entry >> 8) + 1)
+
+
+class LibStructArray:
+    """
+    Writable array of fixed size records stored in a memory mapped file.
+
+    Items are read and written in place with unpack_from and pack_into on the map, so a
+    random update costs the page it touches rather than a rewrite of the file.  The file
+    grows by doubling as records are appended, and flush() and close() cut it back to the
+    records held, so a flushed file always holds exactly len() records.  Records appended
+    since the last flush may be followed by reserved zero records until the next flush.
+    The array is a sequence of value tuples:
+
+        with LibStructArray("table.bin", "little_endian uint32 double") as table:
+            table.append((1, 0.5))
+            table[0] = (2, 1.5)
+            rows = table[10:20]
+    """
+
+    def __init__(self, path, fmt):
+        """
+        Args:
+            path: The file holding the records, created when it does not exist.
+            fmt: LibStruct or format string of one record.
+
+        Raises:
+            struct.error: If the file does not hold a whole number of records.
+        """
+        self.path = os.fspath(path)
+        self.libstruct = fmt if isinstance(fmt, LibStruct) else LibStruct(fmt)
+        self._struct = self.libstruct._compiled.struct
+        self._size = self._struct.size
+        if self._size < 1:
+            raise struct.error("records must be at least 1 byte long")
+
+        self._file = open(self.path, 'r+b' if os.path.exists(self.path) else 'w+b')
+        file_size = os.fstat(self._file.fileno()).st_size
+        if file_size % self._size:
+            self._file.close()
+            raise struct.error(f"{self.path} does not hold a whole number of {self._size} byte records")
+        self._length = file_size // self._size
+        self._mmap = mmap.mmap(self._file.fileno(), 0) if file_size else None
+
+    def __len__(self):
+        return self._length
+
+    def __repr__(self):
+        return f"LibStructArray({self.path!r}, {self.libstruct.human_format!r}, length={self._length})"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _index(self, i: int) -> int:
+        if not -self._length <= i < self._length:
+            raise IndexError("LibStructArray index out of range")
+        return i % self._length
+
+    def __getitem__(self, i):
+        unpack_from = self._struct.unpack_from
+        if isinstance(i, slice):
+            return [unpack_from(self._mmap, index * self._size) for index in range(*i.indices(self._length))]
+        return unpack_from(self._mmap, self._index(i) * self._size)
+
+    def __setitem__(self, i, values):
+        pack_into = self._struct.pack_into
+        if isinstance(i, slice):
+            indexes = range(*i.indices(self._length))
+            values = list(values)
+            if len(values) != len(indexes):
+                raise ValueError(f"can't assign {len(values)} records to a slice of {len(indexes)}, "
+                                 f"the length of a LibStructArray only changes with append")
+            for index, record in zip(indexes, values):
+                pack_into(self._mmap, index * self._size, *record)
+            return
+        pack_into(self._mmap, self._index(i) * self._size, *values)
+
+    def __iter__(self):
+        unpack_from = self._struct.unpack_from
+        for index in range(self._length):
+            yield unpack_from(self._mmap, index * self._size)
+
+    def _reserve(self, length: int):
+        """Make room in the file for length records, at least doubling its size when it grows."""
+        capacity = len(self._mmap) // self._size if self._mmap is not None else 0
+        if length <= capacity:
+            return
+        new_size = max(length, 2 * capacity, 64) * self._size
+        if self._mmap is None:
+            self._file.truncate(new_size)
+            self._mmap = mmap.mmap(self._file.fileno(), 0)
+        else:
+            self._mmap.resize(new_size)
+
+    def append(self, values):
+        """Add one record at the end."""
+        self._reserve(self._length + 1)
+        self._struct.pack_into(self._mmap, self._length * self._size, *values)
+        self._length += 1
+
+    def extend(self, records):
+        """Add records at the end."""
+        for values in records:
+            self.append(values)
+
+    def _trim(self):
+        """Cut the file back to the records held, dropping the room reserved by append."""
+        size = self._length * self._size
+        if self._mmap is None or len(self._mmap) == size:
+            return
+        if size:
+            self._mmap.resize(size)
+        else:
+            self._mmap.close()
+            self._mmap = None
+            self._file.truncate(0)
+
+    def flush(self):
+        """Cut the file back to the records held and write changed pages back to it."""
+        self._trim()
+        if self._mmap is not None:
+            self._mmap.flush()
+
+    def close(self):
+        """Flush and unmap the file."""
+        if self._file.closed:
+            return
+        self.flush()
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+
+
+class _Instrumentation:
+    """
+    Per format call statistics, collected only while instrumentation is enabled.
+
+    Enabling swaps the instrumented methods on the classes for timing wrappers and disabling
+    puts the originals back, so there is no cost at all while it is off.
+    """
+
+    # (class, method, operation, bytes processed from (self, args, kwargs, result))
+    TARGETS = (
+        ('LibStruct', 'pack', 'pack', lambda self, args, kwargs, result: len(result)),
+        ('FrozenLibStruct', 'pack', 'pack', lambda self, args, kwargs, result: len(result)),
+        ('LibStruct', 'unpack', 'unpack', lambda self, args, kwargs, result: self.size),
+        # FrozenLibStruct.as_hex calls LibStruct.as_hex, so it is counted there.
+        ('LibStruct', 'as_hex', 'as_hex',
+         lambda self, args, kwargs, result: memoryview(
+             self.bytes if kwargs.get('buffer') is None else kwargs['buffer']).nbytes),
+    )
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hook = None
+        self.samples = 1024
+        self.operations = {}
+        self.originals = {}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.originals)
+
+    def record(self, operation: str, human_format: str, seconds: float, nbytes: int, cache_hit: bool = None):
+        with self.lock:
+            key = (human_format, operation)
+            entry = self.operations.get(key)
+            if entry is None:
+                entry = self.operations[key] = {'calls': 0, 'bytes': 0, 'seconds': 0.0, 'cache_hits': 0,
+                                                'latencies': deque(maxlen=self.samples)}
+            entry['calls'] += 1
+            entry['bytes'] += nbytes
+            entry['seconds'] += seconds
+            entry['latencies'].append(seconds)
+            if cache_hit:
+                entry['cache_hits'] += 1
+        if self.hook is not None:
+            self.hook(operation, human_format, seconds, nbytes)
+
+    def timed(self, method, operation: str, nbytes):
+        instrumentation = self
+
+        @functools.wraps(method)
+        def timed(self, *args, **kwargs):
+            start = time.perf_counter()
+            result = method(self, *args, **kwargs)
+            seconds = time.perf_counter() - start
+            instrumentation.record(operation, self.human_format, seconds, nbytes(self, args, kwargs, result))
+            return result
+        return timed
+
+    def timed_get(self, get):
+        instrumentation = self
+
+        @functools.wraps(get)
+        def timed_get(self, human_format: str) -> CompiledFormat:
+            cache_hit = human_format in self
+            start = time.perf_counter()
+            compiled = get(self, human_format)
+            instrumentation.record('parse', human_format, time.perf_counter() - start, 0, cache_hit)
+            return compiled
+        return timed_get
+
+    def enable(self, hook, samples: int):
+        if samples < 1:
+            raise ValueError("samples must be >= 1")
+        with self.lock:
+            self.hook = hook
+            self.samples = samples
+            if self.originals:
+                return
+            module = globals()
+            for class_name, method_name, operation, nbytes in self.TARGETS:
+                cls = module[class_name]
+                method = self.originals[cls, method_name] = cls.__dict__[method_name]
+                setattr(cls, method_name, self.timed(method, operation, nbytes))
+            get = self.originals[FormatCache, 'get'] = FormatCache.__dict__['get']
+            FormatCache.get = self.timed_get(get)
+
+    def disable(self):
+        with self.lock:
+            for (cls, method_name), method in self.originals.items():
+                setattr(cls, method_name, method)
+            self.originals.clear()
+            self.hook = None
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            entries = [(key, dict(entry, latencies=sorted(entry['latencies'])))
+                       for key, entry in self.operations.items()]
+        stats = {}
+        for (human_format, operation), entry in entries:
+            latencies = entry.pop('latencies')
+            for name, quantile in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99)):
+                entry[name] = latencies[min(int(quantile * len(latencies)), len(latencies) - 1)]
+            entry['max'] = latencies[-1]
+            if operation != 'parse':
+                del entry['cache_hits']
+            stats.setdefault(human_format, {})[operation] = entry
+        return stats
+
+
+_instrumentation = _Instrumentation()
+
+
+def enable_instrumentation(hook=None, samples: int = 1024):
+    """
+    Start collecting per format statistics of pack, unpack, as_hex and format parsing.
+
+    Instrumentation is off by default and then costs nothing, the methods are only wrapped
+    while it is enabled.
+
+    Args:
+        hook: Called as hook(operation, human_format, seconds, nbytes) after every
+              instrumented call, to forward metrics to another collector.
+        samples: Number of most recent latencies kept per format and operation for percentiles.
+    """
+    _instrumentation.enable(hook, samples)
+
+
+def disable_instrumentation():
+    """Stop collecting statistics and restore the uninstrumented methods.  Collected stats are kept."""
+    _instrumentation.disable()
+
+
+def instrumentation_enabled() -> bool:
+    return _instrumentation.enabled
+
+
+def stats() -> dict:
+    """
+    Snapshot of the statistics collected while instrumentation was enabled.
+
+    Returns:
+        dict: Human readable format to operation ('pack', 'unpack', 'as_hex' or 'parse') to a
+              dict with calls, bytes, seconds (cumulative), p50, p90, p99 and max latencies
+              in seconds, and cache_hits for 'parse'.
+    """
+    return _instrumentation.snapshot()
+
+
+def reset_stats():
+    """Drop all collected statistics."""
+    with _instrumentation.lock:
+        _instrumentation.operations.clear()
+
+
+def _text_value(value):
+    """CSV and JSON friendly form of an unpacked value, strings lose their NUL padding."""
+    if isinstance(value, bytes):
+        return value.rstrip(b'\0').decode('utf-8', 'backslashreplace')
+    return value
+
+
+def _format_records(output_format: str, field_names: tuple[str, ...], records) -> str:
+    """Format records as CSV rows or JSON lines.  Runs in the worker processes of main."""
+    if output_format == 'jsonl':
+        return ''.join(json.dumps(dict(zip(field_names, map(_text_value, record)))) + '\n' for record in records)
+    text = io.StringIO()
+    csv.writer(text, lineterminator='\n').writerows([_text_value(value) for value in record] for record in records)
+    return text.getvalue()
+
+
+def main(argv=None) -> int:
+    """
+    Command line decoder: stream the records of a binary file as CSV, JSON lines or a hex dump.
+
+        libstruct "little_endian uint32 float 8*s" capture.bin --to jsonl --workers 8 --summary
+    """
+    parser = argparse.ArgumentParser(prog='libstruct', description=main.__doc__.strip().split('\n')[0])
+    parser.add_argument('format', help="human readable format of one record, e.g. 'little_endian uint32 float'")
+    parser.add_argument('file', help="binary file of back to back records")
+    parser.add_argument('--compression', choices=('auto', 'gzip', 'bz2', 'lzma'),
+                        help="decompress the file, 'auto' detects it from the header "
+                             "(default: by suffix, .gz .bz2 .xz .lzma)")
+    parser.add_argument('--to', choices=('csv', 'jsonl', 'hex'), default='csv', help="output format (default csv)")
+    parser.add_argument('-o', '--output', help="write to this file instead of standard output")
+    parser.add_argument('--offset', type=int, default=0, help="byte offset of the first record")
+    parser.add_argument('--count', type=int, help="number of records to decode, all by default")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="decode in this many processes, for large uncompressed files")
+    parser.add_argument('--no-header', action='store_true', help="leave out the CSV header row")
+    parser.add_argument('--summary', action='store_true', help="print records, bytes and throughput to stderr")
+    args = parser.parse_args(argv)
+    if args.offset < 0 or (args.count is not None and args.count < 0) or args.workers < 1:
+        parser.error("--offset and --count must be >= 0 and --workers >= 1")
+
+    try:
+        bs = LibStruct(args.format)
+        size = bs.size
+    except (FormatError, struct.error) as e:
+        parser.error(str(e))
+    length = None if args.count is None else args.count * size
+
+    start = time.perf_counter()
+    records = None
+    output = open(args.output, 'w', newline='') if args.output else sys.stdout
+    try:
+        with open_capture(args.file, compression=args.compression) as capture:
+            if args.to == 'hex':
+                if write_hex(output, capture, offset=args.offset, length=length, columns=16, show_ascii=True):
+                    output.write('\n')
+                nbytes = capture.tell() - args.offset
+            else:
+                if args.to == 'csv' and not args.no_header:
+                    output.write(_format_records('csv', (), [bs.field_names]))
+                format_chunk = functools.partial(_format_records, args.to, bs.field_names)
+
+                # Workers map the file, which only works for uncompressed files.
+                if args.workers > 1 and not isinstance(capture, _DECOMPRESSING_FILES):
+                    chunks = bs.parallel_unpack(args.file, workers=args.workers, reduce=_CountedChunk(format_chunk),
+                                                offset=args.offset, count=args.count)
+                else:
+                    capture.seek(args.offset)
+                    decoded = itertools.islice(bs.iter_unpack(capture), args.count)
+                    chunks = ((len(batch), format_chunk(batch))
+                              for batch in iter(lambda: list(itertools.islice(decoded, 10_000)), []))
+                records = 0
+                for count, text in chunks:
+                    output.write(text)
+                    records += count
+                nbytes = records * size
+    except (OSError, struct.error) as e:
+        print(f"libstruct: {e}", file=sys.stderr)
+        return 1
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    if args.summary:
+        seconds = time.perf_counter() - start
+        summary = f"{nbytes} bytes in {seconds:.3f} s, {nbytes / seconds / 1e6:.1f} MB/s"
+        print(summary if records is None else f"{records} records, {summary}", file=sys.stderr)
+    return 0
+
+
+class _CountedChunk:
+    """Picklable reduce for parallel_unpack returning (record count, formatted text) of a chunk."""
+
+    def __init__(self, format_chunk):
+        self.format_chunk = format_chunk
+
+    def __call__(self, records):
+        records = list(records)
+        return len(records), self.format_chunk(records)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
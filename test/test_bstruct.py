@@ -12,7 +12,12 @@ pack and unpack.  I am not trying to validate struct and assume that it just wor
 
 """
 
+import array
+import asyncio
+import io
+import json
 import libstruct
+import pickle
 import struct
 import pytest
 
@@ -345,4 +350,1209 @@ def test_examples(struct_format, data, cols, bytes_per_column,hex_fmt, expected)
     bs = libstruct.LibStruct(struct_format)
     bs.pack(*data)
     hex_value = bs.as_hex(columns=cols, show_address=False, bytes_per_column=bytes_per_column, show_ascii=False,hex_format=hex_fmt)
-    assert hex_value == expected
\ No newline at end of file
+    assert hex_value == expected
+
+
+def test_format_cache_shares_compiled_format():
+    cache = libstruct.format_cache
+    cache.clear()
+
+    bs1 = libstruct.LibStruct("little_endian uint16 float")
+    bs2 = libstruct.LibStruct("little_endian uint16 float")
+
+    assert cache.misses == 1
+    assert cache.hits == 1
+    assert len(cache) == 1
+    assert bs1._compiled is bs2._compiled
+    assert bs1.size == struct.calcsize("<Hf")
+    assert bs2.unpack(bs1.pack(7, 2.5)) == (7, 2.5)
+
+    cache.clear()
+    assert len(cache) == 0
+    assert (cache.hits, cache.misses, cache.evictions) == (0, 0, 0)
+
+
+def test_format_cache_evicts_least_recently_used():
+    cache = libstruct.FormatCache(maxsize=2)
+    cache.get("int8")
+    cache.get("int16")
+    cache.get("int8")  # int16 is now the least recently used
+    cache.get("int32")
+
+    assert cache.evictions == 1
+    assert "int8" in cache
+    assert "int16" not in cache
+    assert "int32" in cache
+    assert cache.get("int32").struct.format == "i"
+
+    with pytest.raises(ValueError):
+        libstruct.FormatCache(maxsize=0)
+
+
+def _records(count):
+    return [(i, i * 0.5, bytes([65 + i % 26]) * 3) for i in range(count)]
+
+
+@pytest.mark.parametrize("wrap", [bytes, bytearray, memoryview])
+def test_iter_unpack_buffers(wrap):
+    bs = libstruct.LibStruct("little_endian uint32 float 3*s")
+    records = _records(100)
+    data = b''.join(bs.pack(*record) for record in records)
+
+    assert list(bs.iter_unpack(wrap(data))) == records
+
+
+@pytest.mark.parametrize("block_size", [1, 7, 11 * 3, 1 << 20])
+def test_iter_unpack_file(tmp_path, block_size):
+    bs = libstruct.LibStruct("little_endian uint32 float 3*s")
+    records = _records(257)
+    path = tmp_path / "records.bin"
+    path.write_bytes(b''.join(bs.pack(*record) for record in records))
+
+    with open(path, 'rb') as file:
+        assert list(bs.iter_unpack(file, block_size=block_size)) == records
+
+
+def test_iter_unpack_mmap(tmp_path):
+    import mmap
+
+    bs = libstruct.LibStruct("big_endian uint16 int64")
+    records = [(i, -i * 1000) for i in range(1000)]
+    path = tmp_path / "records.bin"
+    path.write_bytes(b''.join(bs.pack(*record) for record in records))
+
+    with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        assert list(bs.iter_unpack(mm)) == records
+
+
+def test_iter_unpack_partial_record():
+    bs = libstruct.LibStruct("little_endian uint32")
+    data = bs.pack(1) + bs.pack(2) + b'\x03'
+
+    with pytest.raises(struct.error):
+        list(bs.iter_unpack(data))
+
+    # Files yield the whole records first, then complain about the trailing bytes.
+    decoded = []
+    with pytest.raises(struct.error):
+        for record in bs.iter_unpack(io.BytesIO(data)):
+            decoded.append(record)
+    assert decoded == [(1,), (2,)]
+
+
+def test_pack_into_unpack_from_chaining():
+    header = libstruct.LibStruct("little_endian uint16 uint16")
+    sample = libstruct.LibStruct("little_endian int32 float")
+    samples = [(-1, 0.5), (2, 1.5), (3, -2.25)]
+
+    frame = bytearray(header.size + len(samples) * sample.size + 4)
+    offset = header.pack_into(frame, 4, 0xBEEF, len(samples))
+    for values in samples:
+        offset = sample.pack_into(frame, offset, *values)
+    assert offset == len(frame)
+    assert header.bytes == b''
+
+    values, offset = header.unpack_from(frame, 4)
+    assert values == (0xBEEF, 3)
+    decoded = []
+    for _ in range(values[1]):
+        record, offset = sample.unpack_from(memoryview(frame), offset)
+        decoded.append(record)
+    assert decoded == samples
+    assert offset == len(frame)
+
+
+def test_pack_into_mmap():
+    import mmap
+
+    bs = libstruct.LibStruct("big_endian uint32")
+    with mmap.mmap(-1, 4 * bs.size) as mm:
+        assert bs.pack_into(mm, 8, 0x01020304) == 12
+        assert mm[8:12] == b'\x01\x02\x03\x04'
+        assert bs.unpack_from(mm, 8) == ((0x01020304,), 12)
+
+        with pytest.raises(struct.error):
+            bs.pack_into(mm, 14, 1)
+
+
+@pytest.mark.parametrize("fmt", [
+    "little_endian uint32 float 8*s",
+    "big_endian 2*bool 3*padding 30*s 2*uint32",
+    "network int16 3*double char",
+    "bool int32 str uint16",  # native alignment puts padding before the int32
+])
+def test_numpy_dtype_matches_struct_layout(fmt):
+    np = pytest.importorskip("numpy")
+
+    bs = libstruct.LibStruct(fmt)
+    assert bs.dtype.itemsize == bs.size
+
+    # Packing with struct and decoding with NumPy must agree field by field.
+    count = 5
+    values = {
+        "little_endian uint32 float 8*s": lambda i: (i, i + 0.5, b"tag%d" % i),
+        "big_endian 2*bool 3*padding 30*s 2*uint32": lambda i: (True, False, b"x" * i, i, 2 * i),
+        "network int16 3*double char": lambda i: (-i, 1.0, 2.0, 3.0, b"c"),
+        "bool int32 str uint16": lambda i: (True, -i, b"s", i),
+    }[fmt]
+    data = b''.join(bs.pack(*values(i)) for i in range(count))
+
+    array = bs.unpack_array(data)
+    assert len(array) == count
+    for i, record in enumerate(array.tolist()):
+        flat = []
+        for item in record:
+            flat.extend(np.asarray(item).ravel().tolist() if not isinstance(item, bytes) else [item])
+        expected = [v.rstrip(b'\0') if isinstance(v, bytes) else v for v in bs.unpack(bs.pack(*values(i)))]
+        assert flat == expected
+
+    assert bs.pack_array(array) == data
+
+
+def test_numpy_pack_array_converts_and_zero_pads():
+    np = pytest.importorskip("numpy")
+
+    bs = libstruct.LibStruct("little_endian uint16 2*padding int32")
+    source = np.array([(1, -1), (2, -2)], dtype=[('a', '<u4'), ('b', '<i8')])
+    data = bs.pack_array(source)
+
+    assert data == bs.pack(1, -1) + bs.pack(2, -2)
+    assert bs.unpack_array(data, count=1, offset=bs.size)['field_1'][0] == -2
+
+
+def test_numpy_dtype_names_match_field_names():
+    pytest.importorskip("numpy")
+
+    bs = libstruct.LibStruct("uint8 uint8:f0 3*double pad int16")
+    assert bs.dtype.names == ("field_0", "f0", "field_2", "field_5")
+    assert set(bs.dtype.names) <= set(bs.field_names)
+
+
+def test_numpy_dtype_rejects_pascal_strings():
+    pytest.importorskip("numpy")
+
+    with pytest.raises(ValueError):
+        libstruct.LibStruct("10*p").dtype
+
+
+@pytest.mark.parametrize("bstruct_format, struct_format, names", [
+    ("little_endian uint16:seq float:temp 8*s:tag", "<Hf8s", ('seq', 'temp', 'tag')),
+    ("big_endian 3*int32:xyz padding bool:ok", ">3ix?", ('xyz_0', 'xyz_1', 'xyz_2', 'ok')),
+    ("uint8 uint8:b 2*padding p", "2B2xp", ('field_0', 'b', 'field_2')),
+])
+def test_named_fields(bstruct_format, struct_format, names):
+    bs = libstruct.LibStruct(bstruct_format)
+
+    assert bs.format == struct_format
+    assert bs.field_names == names
+    assert bs.record_class._fields == names
+
+
+def test_unpack_pack_record():
+    bs = libstruct.LibStruct("little_endian uint16:seq float:temp 8*s:tag")
+    data = bs.pack(7, 21.5, b"sensor")
+
+    record = bs.unpack_record(data)
+    assert isinstance(record, tuple)
+    assert type(record) is bs.record_class
+    assert not hasattr(record, '__dict__')
+    assert (record.seq, record.temp, record.tag) == (7, 21.5, b"sensor\0\0")
+    assert record == bs.unpack(data)
+
+    assert bs.pack_record(record) == data
+    assert bs.pack_record({'tag': b"sensor", 'seq': 7, 'temp': 21.5}) == data
+
+    keyed = libstruct.LibStruct("little_endian uint16:keys uint8:items")
+    assert keyed.pack_record(keyed.unpack_record(b"\x01\x00\x02")) == b"\x01\x00\x02"
+    assert keyed.pack_record({'items': 2, 'keys': 1}) == b"\x01\x00\x02"
+
+    # All instances of a format share the generated class.
+    assert libstruct.LibStruct(bs.human_format).record_class is bs.record_class
+
+
+@pytest.mark.parametrize("fmt, values", [
+    ("little_endian uint16:seq 3*padding float:temp 8*s:tag 3*int16:xyz", (1, 2.5, b"tag", -1, 0, 1)),
+    ("bool:ok int32:count 2*double:pair char:c", (True, -5, 1.5, 2.5, b"z")),  # native alignment
+    ("network uint64 10*p:name byte", (2 ** 40, b"pascal", -3)),
+])
+def test_offsets_match_unpack(fmt, values):
+    bs = libstruct.LibStruct(fmt)
+    buffer = b'\xAA' * 3 + bs.pack(*values)
+    expected = bs.unpack(buffer[3:])
+
+    assert len(bs.offsets) == len(expected)
+    assert [bs.unpack_field(i, buffer, 3) for i in range(len(expected))] == list(expected)
+    assert [bs.unpack_field(name, buffer, 3) for name in bs.field_names] == list(expected)
+
+
+def test_record_view_is_lazy_and_cached():
+    bs = libstruct.LibStruct("little_endian uint16:seq float:temp 8*s:tag")
+    buffer = bytearray(bs.pack(3, 1.25, b"abc"))
+    view = bs.view(buffer)
+
+    assert view.seq == 3
+    buffer[0] = 9  # already decoded, the cached value is returned
+    assert view['seq'] == 3
+    assert view[-1] == b"abc\0\0\0\0\0"
+    assert list(view) == [3, 1.25, b"abc\0\0\0\0\0"]
+    assert bs.view(buffer).seq == 9
+
+    with pytest.raises(AttributeError):
+        view.missing
+    with pytest.raises(IndexError):
+        view[3]
+    with pytest.raises(struct.error):
+        bs.view(buffer, 1)
+
+
+@pytest.mark.parametrize("piece_size", [1, 5, 1000])
+def test_aiter_unpack(piece_size):
+    bs = libstruct.LibStruct("little_endian uint32 float 3*s")
+    records = _records(50)
+    data = b''.join(bs.pack(*record) for record in records)
+
+    async def decode():
+        reader = asyncio.StreamReader()
+        for start in range(0, len(data), piece_size):
+            reader.feed_data(data[start:start + piece_size])
+        reader.feed_eof()
+        return [values async for values in bs.aiter_unpack(reader, chunk_size=64)]
+
+    assert asyncio.run(decode()) == records
+
+
+def test_aiter_unpack_partial_record():
+    bs = libstruct.LibStruct("little_endian uint32")
+
+    async def decode():
+        reader = asyncio.StreamReader()
+        reader.feed_data(bs.pack(1) + b'\x02\x00')
+        reader.feed_eof()
+        return [values async for values in bs.aiter_unpack(reader)]
+
+    with pytest.raises(asyncio.IncompleteReadError):
+        asyncio.run(decode())
+
+
+class _FakeStreamWriter:
+    def __init__(self):
+        self.writes = []
+        self.drains = 0
+
+    def write(self, data):
+        self.writes.append(bytes(data))
+
+    async def drain(self):
+        self.drains += 1
+
+
+def test_stream_writer_batches_writes():
+    bs = libstruct.LibStruct("big_endian uint16")
+
+    async def send():
+        fake = _FakeStreamWriter()
+        async with bs.stream_writer(fake, flush_interval=10, buffer_size=4) as writer:
+            for value in range(5):
+                writer.write(value)
+            # Two full blocks went out, the fifth record waits for the flush.
+            assert fake.writes == [bs.pack(0) + bs.pack(1), bs.pack(2) + bs.pack(3)]
+        assert fake.writes[-1] == bs.pack(4)
+        assert fake.drains == 1
+
+        # The flush interval pushes out records even if nothing else is written.
+        fake = _FakeStreamWriter()
+        writer = bs.stream_writer(fake, flush_interval=0.01)
+        writer.write(1)
+        writer.write(2)
+        await asyncio.sleep(0.05)
+        assert fake.writes == [bs.pack(1) + bs.pack(2)]
+
+    asyncio.run(send())
+
+
+def _count_and_sum(records):
+    """Reduce callback for the parallel tests, it must be picklable so it lives at module level."""
+    count = total = 0
+    for values in records:
+        count += 1
+        total += values[0]
+    return count, total
+
+
+@pytest.mark.parametrize("ordered", [True, False])
+def test_parallel_unpack(tmp_path, ordered):
+    bs = libstruct.LibStruct("little_endian uint32 float 3*s")
+    records = _records(5000)
+    path = tmp_path / "records.bin"
+    path.write_bytes(b''.join(bs.pack(*record) for record in records))
+
+    decoded = list(bs.parallel_unpack(path, workers=2, chunk_size=1000, ordered=ordered))
+    if ordered:
+        assert decoded == records
+    else:
+        assert sorted(decoded) == records
+
+    chunks = list(bs.parallel_unpack(path, workers=2, chunk_size=1000, reduce=_count_and_sum, ordered=ordered))
+    assert len(chunks) > 1
+    assert sum(count for count, _ in chunks) == len(records)
+    assert sum(total for _, total in chunks) == sum(record[0] for record in records)
+
+
+def test_parallel_unpack_partial_record(tmp_path):
+    bs = libstruct.LibStruct("little_endian uint32")
+    path = tmp_path / "records.bin"
+    path.write_bytes(bs.pack(1) + b'\x00')
+
+    with pytest.raises(struct.error):
+        list(bs.parallel_unpack(path, workers=1))
+
+    path.write_bytes(b'')
+    assert list(bs.parallel_unpack(path, workers=1)) == []
+
+
+@pytest.mark.parametrize("fmt, values", [
+    ("little_endian bool:ok int8 uint16 3*padding int32 uint32 int64 uint64 float double 4*s:tag char",
+     lambda i: (i % 2 == 0, -i % 128, i * 3, -i * 1000, i * 1000, -i * 2 ** 40, i * 2 ** 40, i / 4, i / 8,
+                b"t%d" % (i % 10), b"c")),
+    ("big_endian int16 3*uint32:xyz 5*p", lambda i: (-i, i, i + 1, i + 2, b"p%d" % (i % 10))),
+    ("bool int32 byte double", lambda i: (True, -i, i % 100, i * 1.5)),  # native alignment
+])
+def test_unpack_columns(fmt, values):
+    bs = libstruct.LibStruct(fmt)
+    data = bytearray(b''.join(bs.pack(*values(i)) for i in range(300)))
+    rows = list(bs.iter_unpack(data))
+
+    columns = bs.unpack_columns(data)
+    assert list(columns) == list(bs.field_names)
+    for index, column in enumerate(columns.values()):
+        assert isinstance(column, (array.array, list))
+        assert list(column) == [row[index] for row in rows]
+
+    assert all(len(column) == 0 for column in bs.unpack_columns(b'').values())
+    with pytest.raises(struct.error):
+        bs.unpack_columns(data[:-1])
+
+
+def test_pack_many():
+    bs = libstruct.LibStruct("little_endian uint32 float 3*s")
+    records = _records(100)
+    expected = b''.join(bs.pack(*record) for record in records)
+    bs.bytes = b''
+
+    assert bs.pack_many(records) == expected
+    assert bs.pack_many(iter(records)) == expected
+    assert bs.bytes == b''
+
+    out = bytearray(len(expected) + 2)
+    assert bs.pack_many(records, out=memoryview(out), offset=2) is not None
+    assert out[2:] == expected
+
+    with pytest.raises(struct.error):
+        bs.pack_many(records, out=bytearray(len(expected) - 1))
+
+
+@pytest.mark.parametrize("block_size", [1, 100, 1 << 20])
+def test_pack_many_to_file(block_size):
+    bs = libstruct.LibStruct("big_endian int64 uint8")
+    records = [(-i, i % 256) for i in range(1000)]
+    file = io.BytesIO()
+
+    assert bs.pack_many(records, file=file, block_size=block_size) == 1000 * bs.size
+    assert file.getvalue() == b''.join(bs.pack(*record) for record in records)
+
+
+@pytest.mark.parametrize("length", [0, 1, 15, 16, 17, 255, 256, 1000])
+@pytest.mark.parametrize("options", [
+    dict(columns=16),
+    dict(columns=16, addr_format='0x{:04X} ', show_ascii=True),
+    dict(columns=8, base_address=0x1000, show_address=False),
+    dict(columns=4, bytes_per_column=2, hex_format="{:04X}"),
+    dict(columns=4, bytes_per_column=4, hex_format="{:08x}", addr_format="{:06X}: "),
+    dict(columns=3, bytes_per_column=2),  # hex_format narrower than a column, like as_hex's default
+    dict(columns=2, bytes_per_column=2, hex_format="0b{:016b}"),
+])
+def test_iter_hex_matches_as_hex(length, options):
+    bs = libstruct.LibStruct(f"{length}*s")
+    bs.pack(bytes((i * 7) % 256 for i in range(length)))
+    expected = bs.as_hex(**options)
+
+    assert '\n'.join(bs.iter_hex(**options)) == expected
+    assert '\n'.join(libstruct.iter_hex(io.BytesIO(bs.bytes), block_size=7, **options)) == expected
+
+    out = io.StringIO()
+    libstruct.write_hex(out, bs.bytes, lines_per_write=3, **options)
+    assert out.getvalue() == expected
+
+
+def test_iter_hex_window(tmp_path):
+    import mmap
+
+    data = bytes(range(256)) * 4
+    path = tmp_path / "dump.bin"
+    path.write_bytes(data)
+
+    expected = list(libstruct.iter_hex(data[0x100:0x100 + 40], base_address=0x100, show_ascii=True))
+    assert list(libstruct.iter_hex(data, offset=0x100, length=40, show_ascii=True)) == expected
+    with open(path, 'rb') as file:
+        assert list(libstruct.iter_hex(file, offset=0x100, length=40, show_ascii=True)) == expected
+    with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        assert list(libstruct.iter_hex(mm, offset=0x100, length=40, show_ascii=True)) == expected
+        assert expected[0].startswith("100 00 01 02")
+
+    with pytest.raises(ValueError):
+        list(libstruct.iter_hex(data, columns=0))
+
+
+@pytest.mark.parametrize("unprintable_char", ['.', '-', '\xb7', '', '<?>', '•'])
+def test_to_ascii_matches_per_byte_conversion(unprintable_char):
+    import mmap
+
+    data = bytes(range(256)) * 2
+    expected = ''.join(chr(b) if 32 <= b < 127 else unprintable_char for b in data)
+
+    bs = libstruct.LibStruct("512*s")
+    bs.pack(data)
+    assert bs.to_ascii(unprintable_char) == expected
+    assert bs.to_ascii(unprintable_char, buffer=memoryview(data)) == expected
+
+    window = ''.join(chr(b) if 32 <= b < 127 else unprintable_char for b in data[30:130])
+    assert bs.to_ascii(unprintable_char, start=30, length=100) == window
+    with mmap.mmap(-1, len(data)) as mm:
+        mm[:] = data
+        assert bs.to_ascii(unprintable_char, buffer=mm, start=30, length=100) == window
+    tail = ''.join(chr(b) if 32 <= b < 127 else unprintable_char for b in data[500:])
+    assert bs.to_ascii(unprintable_char, start=500, length=100) == tail
+
+
+def test_frozen_libstruct_is_immutable_and_stateless():
+    bs = libstruct.FrozenLibStruct("little_endian uint16:seq 4*s:tag")
+
+    data = bs.pack(1, b"abcd")
+    assert bs.bytes == b''
+    assert bs.unpack(data) == (1, b"abcd")
+    assert bs.as_hex(columns=6, buffer=data) == "00 01 00 61 62 63 64"
+    assert bs.to_ascii(buffer=data, start=2) == "abcd"
+    assert list(bs.iter_hex(data, columns=6)) == ["00 01 00 61 62 63 64"]
+
+    # Positional arguments mean the same as for LibStruct, the buffer is never one of them.
+    assert bs.as_hex(6, buffer=data) == libstruct.LibStruct(bs.human_format).as_hex(6, buffer=data)
+    assert bs.to_ascii('-', buffer=b"\x00ab") == "-ab"
+    with pytest.raises(TypeError):
+        bs.to_ascii('-')
+    with pytest.raises(TypeError):
+        bs.as_hex(16)
+    assert bs.unpack_record(data).tag == b"abcd"
+    assert str(bs).startswith("FrozenLibStruct(")
+
+    with pytest.raises(AttributeError):
+        bs.bytes = data
+    with pytest.raises(AttributeError):
+        bs.format = "<I"
+    with pytest.raises(AttributeError):
+        del bs.format
+
+
+def test_frozen_libstruct_threads_do_not_cross_talk():
+    from concurrent.futures import ThreadPoolExecutor
+
+    bs = libstruct.FrozenLibStruct("little_endian uint32:worker uint32:seq 8*s:tag")
+
+    def work(worker):
+        for seq in range(2000):
+            tag = b"w%d" % worker
+            data = bs.pack(worker, seq, tag)
+            record = bs.unpack_record(data)
+            if (record.worker, record.seq, record.tag.rstrip(b'\0')) != (worker, seq, tag):
+                return False
+            if bs.to_ascii(buffer=data, start=8).rstrip('.') != tag.decode():
+                return False
+            offset = bs.pack_into(buffer := bytearray(bs.size), 0, worker, seq, tag)
+            if bs.unpack_from(buffer) != (bs.unpack(data), offset):
+                return False
+        return True
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        assert all(pool.map(work, range(16)))
+
+
+@pytest.mark.parametrize("bstruct_format, message, position", [
+    ("little_endian uint17", "unknown type 'uint17'", 14),
+    ("int32 flaot double", "unknown type 'flaot'", 6),
+    ("x*int32", "repeat count 'x' is not a whole number", 0),
+    ("int8 *int32", "repeat count '' is not a whole number", 5),
+    ("int8 3**int32", "repeat count '3*' is not a whole number", 5),
+    ("int8 3*", "unknown type ''", 7),
+    ("int8 big_endian int16", "byte order 'big_endian' must be the first part", 5),
+    ("little_endian network int16", "byte order 'network' must be the first part", 14),
+    ("int8:1st", "invalid field name '1st'", 5),
+    ("int8:a int16:a", "duplicate field name 'a'", 7),
+    ("2*int8:a int16:a_1", "duplicate field name 'a_1'", 9),
+])
+def test_format_errors(bstruct_format, message, position):
+    with pytest.raises(libstruct.FormatError) as exc_info:
+        libstruct.LibStruct(bstruct_format)
+
+    assert exc_info.value.message == message
+    assert exc_info.value.position == position
+    assert isinstance(exc_info.value, ValueError)
+    assert bstruct_format not in libstruct.format_cache
+
+
+def test_format_error_pickles():
+    with pytest.raises(libstruct.FormatError) as exc_info:
+        libstruct.LibStruct("little_endian uint16 flaot")
+    error = pickle.loads(pickle.dumps(exc_info.value))
+
+    assert (error.message, error.format_string, error.position) == ("unknown type 'flaot'",
+                                                                   "little_endian uint16 flaot", 21)
+    assert str(error) == str(exc_info.value) == ("unknown type 'flaot' at position 21\n"
+                                                 "    little_endian uint16 flaot\n"
+                                                 "                         ^")
+
+
+@pytest.mark.parametrize("bstruct_format, struct_format", [
+    ("int32 int32", "2i"),
+    ("little_endian 2*int32 3*int32 uint32 uint32", "<5i2I"),
+    ("padding pad 2*padding ubyte", "4xB"),
+    ("4*s 4*s p p", "4s4spp"),  # strings are a length, never merged
+    ("char char", "2c"),
+    ("1*int16", "h"),
+    ("0*int32 int32", "0ii"),
+    ("", ""),
+])
+def test_format_merges_adjacent_types(bstruct_format, struct_format):
+    assert libstruct.LibStruct.decode_human_readable_fmt(bstruct_format) == struct_format
+
+
+@pytest.mark.parametrize("bstruct_format", [
+    "bool int32 str uint16 double",
+    "byte 3*int16 int64 char 5*s float P",
+    "little_endian bool int32 str uint16 double",
+    "network 2*byte 10*p uint64 pad",
+])
+def test_compiled_layout_matches_struct(bstruct_format):
+    compiled = libstruct.compile_format(bstruct_format)
+    prefix = compiled.byte_order
+
+    assert compiled.size == struct.calcsize(compiled.format)
+    tokens = ''
+    for field in compiled.fields:
+        token = f"{field.count}{field.code}"
+        assert field.offset == struct.calcsize(prefix + tokens + '0' + field.code)
+        assert field.size == struct.calcsize(prefix + token)
+        assert bstruct_format[field.position:].split()[0].split(':')[0].split('*')[-1] == field.type
+        tokens += token
+    assert compiled.alignment == (1 if prefix else max(struct.calcsize('c0' + f.code) for f in compiled.fields))
+
+
+def test_generated_unpacker_and_packer(capsys):
+    bs = libstruct.LibStruct("little_endian uint16:seq int16:temp 8*s:tag char:code 4*s:raw float:gain")
+    converters = {'temp': 0.01, 'tag': 'str', 'code': 'int', 'raw': 'strip',
+                  5: (lambda v: v * 2, lambda v: v / 2)}
+
+    unpack = bs.make_unpacker(converters)
+    pack = bs.make_packer(converters)
+    data = pack(7, 21.5, "probe", 65, b"ab", 3.0)
+
+    assert bs.unpack(data) == (7, 2150, b"probe\0\0\0", b"A", b"ab\0\0", 1.5)
+    assert unpack(data) == (7, 21.5, "probe", 65, b"ab", 3.0)
+    assert unpack(b'\xff' + data, 1) == unpack(data)
+
+    record = bs.make_unpacker(converters, record=True)(data)
+    assert type(record) is bs.record_class
+    assert record.tag == "probe"
+
+    # Generated functions are cached per format and converter spec.
+    assert bs.make_unpacker(converters) is unpack
+    assert libstruct.LibStruct(bs.human_format).make_packer(converters) is pack
+
+    bs.make_unpacker({'temp': 0.01}, debug=True)
+    source = capsys.readouterr().err
+    assert source.startswith("def unpack(buffer, offset=0):")
+    assert "v1 * _scale1" in source
+
+
+def test_generated_codec_single_value():
+    bs = libstruct.LibStruct("big_endian 3*s")
+    assert bs.make_unpacker({0: ('str', 'ascii')})(b"ok\0") == ("ok",)
+    assert bs.make_packer({0: ('str', 'ascii')})("ok") == b"ok\0"
+
+
+@pytest.mark.parametrize("converters, error", [
+    ({'seq': 'str'}, ValueError),
+    ({'tag': 0.5}, ValueError),
+    ({'tag': 'int'}, ValueError),
+    ({'nope': 'strip'}, KeyError),
+])
+def test_generated_codec_rejects_bad_converters(converters, error):
+    bs = libstruct.LibStruct("little_endian uint16:seq 8*s:tag")
+    with pytest.raises(error):
+        bs.make_unpacker(converters)
+
+
+def test_generated_packer_needs_encoder():
+    bs = libstruct.LibStruct("little_endian uint16:seq")
+    assert bs.make_unpacker({'seq': hex})(bs.pack(255)) == ('0xff',)
+    with pytest.raises(ValueError):
+        bs.make_packer({'seq': hex})
+
+
+@pytest.mark.parametrize("bstruct_format", [
+    "little_endian uint16{mode:3,err:1,count:12}:flags float",
+    "big_endian float uint16{mode:3, err:1, count:12}",
+    "int16{mode:3,err:1,count:12} uint32{low:16,high:16}",  # signed, native alignment
+])
+def test_bitfields(bstruct_format):
+    bs = libstruct.LibStruct(bstruct_format)
+    assert bs.bitfield_names[:3] == ('mode', 'err', 'count')
+    word_index = [field.bits is not None for field in bs.fields].index(True)
+
+    records = []
+    for i in range(50):
+        word = bs.pack_bits(word_index, mode=i % 8, err=i % 2, count=i * 81 % 4096)
+        values = [2.5] * len(bs.field_names)
+        values[word_index] = word
+        if 'low' in bs.bitfield_names:
+            values[1] = bs.pack_bits(1, low=i, high=0xFFFF - i)
+        records.append(bs.pack(*values))
+
+        bits = bs.unpack_bits(records[-1])
+        assert (bits.mode, bits.err, bits.count) == (i % 8, i % 2, i * 81 % 4096)
+
+    columns = bs.unpack_bits_columns(b''.join(records))
+    assert list(columns) == list(bs.bitfield_names)
+    assert list(columns['count']) == [i * 81 % 4096 for i in range(50)]
+    assert list(columns['err']) == [i % 2 for i in range(50)]
+    if 'high' in columns:
+        assert list(columns['high']) == [0xFFFF - i for i in range(50)]
+
+
+def test_bitfields_without_numpy(monkeypatch):
+    monkeypatch.setattr(libstruct, "_numpy", lambda: None)
+    bs = libstruct.LibStruct("big_endian uint32{a:1,b:31}")
+    data = bs.pack(bs.pack_bits(0, a=1, b=5)) + bs.pack(bs.pack_bits(0, b=2 ** 31 - 1))
+
+    columns = bs.unpack_bits_columns(data)
+    assert list(columns['a']) == [1, 0]
+    assert list(columns['b']) == [5, 2 ** 31 - 1]
+
+
+@pytest.mark.parametrize("bstruct_format, message", [
+    ("uint8{a:3,b:6}", "bitfields need more than the 8 bits of the value"),
+    ("float{a:3}", "bitfields need an integer type"),
+    ("uint8{a:3", "missing '}' after bitfields"),
+    ("uint8{a}", "bitfield 'a' must be 'name:width' with a width of at least 1"),
+    ("uint8{a:0}", "bitfield 'a:0' must be 'name:width' with a width of at least 1"),
+    ("uint8{}", "empty bitfield list"),
+    ("2*uint8{a:1}", "bitfields can't be repeated"),
+    ("uint8{a:1} uint8{a:2}", "duplicate bitfield name 'a'"),
+    ("uint8{a:1}x", "unexpected text after bitfields"),
+])
+def test_bitfield_errors(bstruct_format, message):
+    with pytest.raises(libstruct.FormatError) as exc_info:
+        libstruct.LibStruct(bstruct_format)
+    assert exc_info.value.message == message
+
+
+def test_pack_bits_range_checks():
+    bs = libstruct.LibStruct("uint8{a:3,b:5}:flags uint8{c:8}")
+    with pytest.raises(ValueError):
+        bs.pack_bits('flags', a=8)
+    with pytest.raises(ValueError):
+        bs.pack_bits('flags', c=1)
+    assert bs.pack_bits('flags', a=7, b=1) == 0b1111
+
+
+def _scan_records(count):
+    bs = libstruct.LibStruct("little_endian uint16:msg_id 6*pad double:timestamp 4*s:tag")
+    return bs, [(i % 7, i * 0.5, b"t%03d" % (i % 1000)) for i in range(count)]
+
+
+@pytest.mark.parametrize("source_type", ["bytes", "file", "mmap"])
+@pytest.mark.parametrize("block_size", [16, 1000, libstruct.DEFAULT_BLOCK_SIZE])
+def test_scan_where(tmp_path, source_type, block_size):
+    bs, records = _scan_records(2000)
+    data = bs.pack_many(records)
+    expected = [record for record in records if record[0] == 3 and 100 <= record[1] < 200]
+
+    path = tmp_path / "capture.bin"
+    path.write_bytes(data)
+    with open(path, "rb") as file:
+        if source_type == "bytes":
+            source = data
+        elif source_type == "file":
+            source = file
+        else:
+            source = libstruct.mmap.mmap(file.fileno(), 0, access=libstruct.mmap.ACCESS_READ)
+        scan = bs.scan(source, where={"msg_id": 3, "timestamp": lambda t: 100 <= t < 200}, block_size=block_size)
+        assert list(scan) == expected
+        assert (scan.scanned, scan.matched) == (2000, len(expected))
+        if source_type == "mmap":
+            source.close()
+
+
+def test_scan_predicate_and_records():
+    bs, records = _scan_records(500)
+    data = bs.pack_many(records)
+
+    scan = bs.scan(data, where={"msg_id": {1, 2}}, predicate=lambda tag, ts: tag.endswith(b"0") and ts > 10,
+                   keys=("tag", "timestamp"), record=True)
+    found = list(scan)
+    assert found == [bs.record_class._make(record) for record in records
+                     if record[0] in (1, 2) and record[2].endswith(b"0") and record[1] > 10]
+    assert found[0].msg_id in (1, 2)
+    assert scan.scanned == 500 and scan.matched == len(found)
+
+    assert list(bs.scan(data, where={0: range(0, 1)})) == [record for record in records if record[0] == 0]
+    assert len(list(bs.scan(data))) == 500
+
+
+def test_scan_errors():
+    bs, records = _scan_records(4)
+    with pytest.raises(KeyError):
+        bs.scan(b"", where={"missing": 1})
+    with pytest.raises(ValueError):
+        bs.scan(b"", predicate=lambda: True)
+    with pytest.raises(struct.error):
+        list(bs.scan(bs.pack_many(records) + b"x", where={"msg_id": 1}))
+
+
+def _write_mixed(file, header, sample, start, count):
+    for i in range(start, start + count):
+        if i % 5 == 0:
+            file.write(b"\x01" + header.pack(i, b"hdr"))
+        else:
+            file.write(b"\x02" + sample.pack(i, i * 0.25))
+
+
+def test_record_index(tmp_path):
+    header = libstruct.LibStruct("little_endian uint32 3*s")
+    sample = libstruct.LibStruct("little_endian uint16 double")
+    path = tmp_path / "mixed.bin"
+    with open(path, "wb") as file:
+        _write_mixed(file, header, sample, 0, 100)
+
+    with libstruct.RecordIndex(path, {1: header, 2: sample}) as index:
+        assert len(index) == 100
+        assert index.record(0) == (1, (0, b"hdr"))
+        assert index.record(7) == (2, (7, 1.75))
+        assert index.record(-1) == (2, (99, 24.75))
+        assert [values[0] for _, values in index.records(10, 20)] == list(range(10, 20))
+
+        # Grow the log, with a record cut short at the end.
+        with open(path, "ab") as file:
+            _write_mixed(file, header, sample, 100, 10)
+            file.write(b"\x02" + sample.pack(110, 0.5)[:1])
+        assert index.update() == 10
+        assert index.record(105) == (1, (105, b"hdr"))
+
+    assert (tmp_path / "mixed.bin.idx").stat().st_size == 110 * 8
+    # Reopening reads the sidecar and only walks what was appended since.
+    with open(path, "ab") as file:
+        file.write(sample.pack(110, 0.5)[1:])
+    with libstruct.RecordIndex(path, {1: "little_endian uint32 3*s", 2: sample}) as index:
+        assert len(index) == 111
+        assert index.record(110) == (2, (110, 0.5))
+        assert index.offset(1) == 1 + header.size
+
+
+def test_record_index_errors(tmp_path):
+    path = tmp_path / "mixed.bin"
+    path.write_bytes(b"\x03\x00")
+    with pytest.raises(ValueError, match="unknown record type 3 at offset 0"):
+        libstruct.RecordIndex(path, {1: "uint8"})
+    with pytest.raises(ValueError):
+        libstruct.RecordIndex(path, {256: "uint8"})
+
+    path.write_bytes(b"")
+    with libstruct.RecordIndex(path, {1: "uint8"}) as index:
+        assert len(index) == 0
+        assert list(index.records()) == []
+
+
+@pytest.fixture
+def instrumentation():
+    libstruct.reset_stats()
+    yield
+    libstruct.disable_instrumentation()
+    libstruct.reset_stats()
+
+
+def test_instrumentation(instrumentation):
+    original_pack = libstruct.LibStruct.pack
+    calls = []
+    libstruct.enable_instrumentation(hook=lambda *call: calls.append(call))
+    assert libstruct.instrumentation_enabled()
+
+    fmt = "little_endian uint32 float instrumented"
+    with pytest.raises(libstruct.FormatError):
+        libstruct.LibStruct(fmt)
+    fmt = "little_endian uint32 float:instrumented"
+    bs = libstruct.LibStruct(fmt)
+    libstruct.LibStruct(fmt)
+    for i in range(10):
+        bs.unpack(bs.pack(i, 0.5))
+    bs.as_hex(columns=16)
+    frozen = libstruct.FrozenLibStruct(fmt)
+    frozen.as_hex(columns=16, buffer=frozen.pack(1, 2.0))
+
+    snapshot = libstruct.stats()[fmt]
+    assert snapshot['pack']['calls'] == 11 and snapshot['pack']['bytes'] == 88
+    assert snapshot['unpack']['calls'] == 10 and snapshot['unpack']['bytes'] == 80
+    assert snapshot['as_hex']['calls'] == 2 and snapshot['as_hex']['bytes'] == 16
+    assert snapshot['parse']['calls'] == 3
+    assert snapshot['parse']['cache_hits'] >= 2
+    unpack = snapshot['unpack']
+    assert 0 <= unpack['p50'] <= unpack['p90'] <= unpack['p99'] <= unpack['max'] <= unpack['seconds']
+    assert [call[:2] for call in calls[:4]] == [('parse', fmt), ('parse', fmt), ('pack', fmt), ('unpack', fmt)]
+    assert calls[2][3] == 8 and calls[2][2] >= 0
+
+    libstruct.disable_instrumentation()
+    assert not libstruct.instrumentation_enabled()
+    assert libstruct.LibStruct.pack is original_pack
+    bs.pack(1, 1.0)
+    assert libstruct.stats()[fmt]['pack']['calls'] == 11
+
+    libstruct.reset_stats()
+    assert libstruct.stats() == {}
+
+
+@pytest.mark.parametrize("use_numpy", [True, False])
+@pytest.mark.parametrize("fields, record", [
+    ("uint16 4*s int32 byte 2*double pad uint64 bool float",
+     lambda i: (i, b"ab", -i, i % 100, i * 0.5, -i * 0.5, 2 ** 40 + i, True, 0.25)),
+    ("int16{a:4,b:12} 2*int16 char 5*p uint32",
+     lambda i: (-i, i, 1000 + i, b"c", b"pas", 2 ** 31 + i)),
+])
+def test_byteswap_buffer(monkeypatch, use_numpy, fields, record):
+    if not use_numpy:
+        monkeypatch.setattr(libstruct, "_numpy", lambda: None)
+    elif libstruct._numpy() is None:
+        pytest.skip("numpy not installed")
+    big = libstruct.LibStruct("big_endian " + fields)
+    little = libstruct.LibStruct("little_endian " + fields)
+    records = [record(i) for i in range(20)]
+    buffer = bytearray(big.pack_many(records))
+
+    big.byteswap_buffer(buffer, "little_endian")
+    assert buffer == little.pack_many(records)
+    little.byteswap_buffer(memoryview(buffer), "network")
+    assert buffer == big.pack_many(records)
+
+    # Already in the target byte order.
+    big.byteswap_buffer(buffer, "big_endian")
+    assert buffer == big.pack_many(records)
+
+
+def test_byteswap_buffer_errors():
+    bs = libstruct.LibStruct("big_endian uint32")
+    with pytest.raises(ValueError):
+        bs.byteswap_buffer(bytearray(4), "middle_endian")
+    with pytest.raises(ValueError):
+        libstruct.LibStruct("uint32").byteswap_buffer(bytearray(4), "big_endian")
+    with pytest.raises(struct.error):
+        bs.byteswap_buffer(bytearray(6), "little_endian")
+
+
+@pytest.mark.parametrize("suffix, magic", [(".gz", b"\x1f\x8b"), (".bz2", b"BZh"), (".xz", b"\xfd7zXZ"),
+                                           (".bin", None)])
+def test_compressed_captures(tmp_path, suffix, magic):
+    bs = libstruct.LibStruct("little_endian uint32 float 8*s")
+    records = _records(5000)
+    path = tmp_path / ("capture" + suffix)
+    with libstruct.open_capture(path, "wb", level=1) as file:
+        assert bs.pack_many(records, file=file, block_size=1000) == bs.size * 5000
+    if magic:
+        assert path.read_bytes().startswith(magic)
+    else:
+        assert path.read_bytes() == bs.pack_many(records)
+
+    assert list(bs.iter_unpack(path, block_size=1000)) == [bs.unpack(bs.pack(*record)) for record in records]
+    with open(path, "rb") as file:
+        assert len(list(bs.iter_unpack(file, compression="auto"))) == 5000
+        assert not file.closed
+    with open(path, "rb") as file:
+        scan = bs.scan(io.BytesIO(file.read()), where={0: range(100)}, compression="auto")
+        assert len(list(scan)) == 100
+
+
+@pytest.mark.parametrize("compression", [None, "auto"])
+def test_uncompressed_capture_with_gzip_magic(tmp_path, compression):
+    bs = libstruct.LibStruct("little_endian uint16 uint16")
+    records = [(0x8b1f, i) for i in range(100)] + [(0x5a42, 0x3968)]
+    data = bs.pack_many(records)
+    assert data.startswith(b"\x1f\x8b")
+    path = tmp_path / "capture.bin"
+    path.write_bytes(data)
+
+    assert list(bs.iter_unpack(io.BytesIO(data), compression=compression)) == records
+    assert list(bs.iter_unpack(path, compression=compression)) == records
+    with open(path, "rb") as file:
+        assert len(list(bs.scan(file, where={1: 5}, compression=compression))) == 1
+
+    # Without a valid header 'auto' leaves a capture starting with the bz2 magic alone too.
+    bz2_like = bs.pack_many(records[::-1])
+    assert bz2_like.startswith(b"BZh9")
+    assert list(bs.iter_unpack(io.BytesIO(bz2_like), compression="auto")) == records[::-1]
+
+
+@pytest.mark.parametrize("wrap", [bytes, bytearray, memoryview])
+def test_compressed_buffers(wrap):
+    import gzip
+    import lzma
+    bs = libstruct.LibStruct("little_endian uint32 float 3*s")
+    records = [bs.unpack(bs.pack(*record)) for record in _records(300)]
+    data = bs.pack_many(records)
+
+    assert list(bs.iter_unpack(wrap(gzip.compress(data)), compression="gzip")) == records
+    assert list(bs.iter_unpack(wrap(lzma.compress(data)), compression="auto")) == records
+    assert list(bs.iter_unpack(wrap(data), compression="auto")) == records
+    scan = bs.scan(wrap(gzip.compress(data)), where={0: 7}, compression="gzip")
+    assert list(scan) == [records[7]]
+    with pytest.raises(OSError):
+        list(bs.iter_unpack(wrap(data), compression="gzip"))
+
+
+def test_open_capture_explicit(tmp_path):
+    raw = io.BytesIO()
+    with libstruct.open_capture(raw, "wb", compression="bz2") as file:
+        file.write(b"\x00" * 8)
+    raw.seek(0)
+    assert libstruct._compression_of(raw) == "bz2" and raw.tell() == 0
+    assert libstruct.open_capture(raw) is raw
+    with libstruct.open_capture(raw, compression="auto") as file:
+        assert file.read() == b"\x00" * 8
+
+    with pytest.raises(ValueError):
+        libstruct.open_capture(raw, compression="zip")
+    with pytest.raises(ValueError):
+        libstruct.open_capture(raw, "r")
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+@pytest.mark.parametrize("suffix", [".bin", ".gz"])
+def test_main_csv_and_jsonl(tmp_path, capsys, workers, suffix):
+    bs = libstruct.LibStruct("little_endian uint32:seq float 3*s:tag")
+    path = tmp_path / ("capture" + suffix)
+    with libstruct.open_capture(path, "wb") as file:
+        bs.pack_many(_records(1000), file=file)
+
+    out = tmp_path / "out.csv"
+    assert libstruct.main([bs.human_format, str(path), "-o", str(out), "--workers", str(workers),
+                           "--offset", str(bs.size * 10), "--count", "500", "--summary"]) == 0
+    lines = out.read_text().splitlines()
+    assert lines[0] == "seq,field_1,tag"
+    assert lines[1:3] == ["10,5.0,KKK", "11,5.5,LLL"]
+    assert len(lines) == 501
+    assert f"500 records, {500 * bs.size} bytes" in capsys.readouterr().err
+
+    compression = ["--compression", "auto"] if suffix == ".gz" else []
+    assert libstruct.main([bs.human_format, str(path), "--to", "jsonl", "--workers", str(workers), *compression]) == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 1000
+    assert json.loads(lines[-1]) == {"seq": 999, "field_1": 499.5, "tag": "LLL"}
+
+
+def test_main_hex_and_errors(tmp_path, capsys):
+    path = tmp_path / "capture.bin"
+    path.write_bytes(bytes(range(64)))
+    assert libstruct.main(["uint16", str(path), "--to", "hex", "--offset", "16", "--count", "8"]) == 0
+    assert capsys.readouterr().out == libstruct.LibStruct("64*s").as_hex(
+        columns=16, show_ascii=True, buffer=bytes(range(64))).splitlines(keepends=True)[1]
+
+    with pytest.raises(SystemExit):
+        libstruct.main(["uint16 flaot", str(path)])
+    assert "unknown type 'flaot'" in capsys.readouterr().err
+    assert libstruct.main(["uint16", str(tmp_path / "missing.bin")]) == 1
+    assert libstruct.main(["3*s", str(path)]) == 1
+
+
+def test_libstruct_array(tmp_path):
+    path = tmp_path / "table.bin"
+    with libstruct.LibStructArray(path, "little_endian uint32 double") as table:
+        assert len(table) == 0 and list(table) == []
+        for i in range(1000):
+            table.append((i, i * 0.5))
+        table.extend([(1000, 0.0)])
+        assert len(table) == 1001
+        assert table[3] == (3, 1.5) and table[-1] == (1000, 0.0)
+
+        table[3] = (33, 3.25)
+        table[10:14:2] = [(10, 1.0), (12, 2.0)]
+        assert table[9:14] == [(9, 4.5), (10, 1.0), (11, 5.5), (12, 2.0), (13, 6.5)]
+        table.flush()
+
+        with pytest.raises(IndexError):
+            table[1001]
+        with pytest.raises(ValueError):
+            table[0:2] = [(0, 0.0)]
+        assert path.stat().st_size == 1001 * 12
+
+    assert path.stat().st_size == 1001 * 12
+    with libstruct.LibStructArray(path, libstruct.LibStruct("little_endian uint32 double")) as table:
+        assert len(table) == 1001
+        assert table[3] == (33, 3.25)
+        table[-1] = (7, 7.0)
+        table.append((8, 8.0))
+    assert path.read_bytes()[-24:] == libstruct.LibStruct("little_endian uint32 double").pack_many(
+        [(7, 7.0), (8, 8.0)])
+
+
+def test_libstruct_array_flush_without_close(tmp_path):
+    path = tmp_path / "table.bin"
+    table = libstruct.LibStructArray(path, "little_endian uint32 double")
+    table.append((1, 0.5))
+    table.flush()
+    assert path.stat().st_size == 12
+
+    reader = libstruct.LibStructArray(path, "little_endian uint32 double")
+    assert len(reader) == 1 and reader[0] == (1, 0.5)
+    reader.close()
+
+    # Appending after a flush grows the file again and the next flush trims it.
+    for i in range(100):
+        table.append((i, 1.0))
+    table[0] = (2, 2.5)
+    table.flush()
+    with libstruct.LibStructArray(path, "little_endian uint32 double") as reader:
+        assert len(reader) == 101 and reader[0] == (2, 2.5) and reader[-1] == (99, 1.0)
+    table.close()
+    assert path.stat().st_size == 101 * 12
+
+
+def test_libstruct_array_partial_file(tmp_path):
+    path = tmp_path / "table.bin"
+    path.write_bytes(b"\x00" * 5)
+    with pytest.raises(struct.error):
+        libstruct.LibStructArray(path, "uint32")
+
+
+@pytest.fixture
+def named_formats():
+    saved = libstruct.registered_formats()
+    yield
+    for name in set(libstruct.registered_formats()) - set(saved):
+        libstruct.unregister_format(name)
+
+
+def test_nested_formats(named_formats):
+    libstruct.register_format("msg_header", "little_endian uint16:msg_id uint8{kind:3,urgent:1} 2*pad")
+    libstruct.register_format("msg_sample", libstruct.LibStruct("little_endian int16:t 2*float 4*s:tag"))
+    bs = libstruct.LibStruct("little_endian msg_header 3*msg_sample:samples double:stamp")
+
+    assert bs.field_names[:3] == ("msg_header_msg_id", "msg_header_field_1", "samples_0_t")
+    assert bs.field_names[3:6] == ("samples_0_field_1", "samples_0_field_2", "samples_0_tag")
+    assert bs.field_names[-1] == "stamp"
+    assert "samples_2_tag" in bs.field_names
+    assert bs.bitfield_names == ("msg_header_kind", "msg_header_urgent")
+    assert bs.format == "<HB2xh2f4sh2f4sh2f4sd"
+    assert bs.size == 5 + 3 * 14 + 8
+
+    values = (7, 0b1010, 1, 0.5, 1.5, b"abcd", 2, 2.5, 3.5, b"efgh", 3, 4.5, 5.5, b"ijkl", 9.25)
+    data = bs.pack(*values)
+    assert bs.unpack(data) == values
+
+    msg = bs.unpack_nested(data)
+    assert msg._fields == ("msg_header", "samples", "stamp")
+    assert msg.msg_header.msg_id == 7 and msg.msg_header.field_1 == 0b1010
+    assert len(msg.samples) == 3
+    assert msg.samples[1] == (2, 2.5, 3.5, b"efgh")
+    assert msg.samples[2].tag == b"ijkl"
+    assert msg.stamp == 9.25
+    assert bs.nest(values) == msg
+
+    # Formats that use a nested format can be registered and nested again.
+    libstruct.register_format("msg_pair", "little_endian 2*msg_sample:pair uint8:n")
+    outer = libstruct.LibStruct("little_endian msg_pair")
+    nested = outer.unpack_nested(outer.pack(*values[2:10], 5))
+    assert nested.msg_pair.pair[1].t == 2 and nested.msg_pair.n == 5
+
+    plain = libstruct.LibStruct("little_endian uint16:a")
+    assert plain.unpack_nested(plain.pack(3)) == plain.record_class(3)
+
+
+@pytest.mark.parametrize("bstruct_format, message", [
+    ("big_endian msg_le", "format 'msg_le' has a different byte order"),
+    ("msg_le", "format 'msg_le' has a different byte order"),
+    ("msg_le{a:1}", "bitfields need an integer type"),
+    ("little_endian msg_native", "format 'msg_native' has native alignment and no byte order"),
+    ("network msg_native", "format 'msg_native' has native alignment and no byte order"),
+    ("2*msg_native", "format 'msg_native' can't be repeated, its size isn't a multiple of its alignment"),
+    ("little_endian msg_le msg_le", "duplicate field name 'msg_le_field_0'"),
+])
+def test_nested_format_errors(named_formats, bstruct_format, message):
+    libstruct.register_format("msg_le", "little_endian uint16")
+    libstruct.register_format("msg_native", "int32 int8")
+    with pytest.raises(libstruct.FormatError) as exc_info:
+        libstruct.LibStruct(bstruct_format)
+    assert exc_info.value.message == message
+
+
+def test_register_format_errors(named_formats):
+    libstruct.register_format("msg_one", "uint8")
+    libstruct.register_format("msg_one", "uint8")
+    with pytest.raises(ValueError):
+        libstruct.register_format("msg_one", "uint16")
+    for name in ("uint8", "little_endian", "bad name", "_private"):
+        with pytest.raises(ValueError):
+            libstruct.register_format(name, "uint8")
+    with pytest.raises(libstruct.FormatError):
+        libstruct.register_format("msg_two", "flaot")
+    assert "msg_two" not in libstruct.registered_formats()
+
+    libstruct.unregister_format("msg_one")
+    libstruct.register_format("msg_one", "uint16")
+    assert libstruct.registered_formats()["msg_one"] == "uint16"
+    with pytest.raises(KeyError):
+        libstruct.unregister_format("msg_three")
+
+
+def test_nested_native_formats(named_formats):
+    libstruct.register_format("msg_native", "int32 int8")
+    libstruct.register_format("msg_padded", "int32 int8 3*pad")
+    once = libstruct.LibStruct("int8:a msg_native:n")
+    assert once.size == struct.calcsize("bib")
+    assert once.unpack(once.pack(1, 2, 3)) == (1, 2, 3)
+
+    twice = libstruct.LibStruct("2*msg_padded:p")
+    assert twice.size == 2 * libstruct.LibStruct("msg_padded").size == 16
+    assert twice.unpack_nested(twice.pack(1, 2, 3, 4)).p[1] == (3, 4)
+
+
+def test_reregistered_format_is_not_served_stale(named_formats):
+    libstruct.register_format("msg_pair", "little_endian 2*int16")
+    libstruct.register_format("msg_outer", "little_endian msg_pair uint8")
+    fmt = "little_endian msg_outer:o"
+    old = libstruct.LibStruct(fmt)
+    old_unpack = old.make_unpacker()
+    assert old.size == 5
+
+    libstruct.unregister_format("msg_pair")
+    assert fmt not in libstruct.format_cache
+    assert "little_endian msg_outer uint8" not in libstruct.format_cache
+    libstruct.register_format("msg_pair", "little_endian 2*int32")
+    libstruct.unregister_format("msg_outer")
+    libstruct.register_format("msg_outer", "little_endian msg_pair uint8")
+
+    new = libstruct.LibStruct(fmt)
+    assert new.size == 9 and new.format == "<2iB"
+    data = new.pack(1, 2, 3)
+    assert new.make_unpacker()(data) == (1, 2, 3)
+    assert new.make_packer()(1, 2, 3) == data
+    # Instances built before keep their own layout.
+    assert old.size == 5 and old_unpack(old.pack(1, 2, 3)) == (1, 2, 3)
+
+
+def test_nested_parallel_unpack_spawn(tmp_path, monkeypatch, named_formats):
+    import multiprocessing
+    libstruct.register_format("msg_point", "little_endian int16:x int16:y")
+    bs = libstruct.LibStruct("little_endian uint32:seq 2*msg_point:p")
+    records = [(i, i, -i, 2 * i, -2 * i) for i in range(1000)]
+    path = tmp_path / "capture.bin"
+    path.write_bytes(bs.pack_many(records))
+
+    # Spawned workers don't inherit the registry, they must not need it.
+    original = libstruct.ProcessPoolExecutor
+    monkeypatch.setattr(libstruct, "ProcessPoolExecutor",
+                        lambda **kwargs: original(mp_context=multiprocessing.get_context("spawn"), **kwargs))
+    assert list(bs.parallel_unpack(path, workers=2, chunk_size=1000)) == records